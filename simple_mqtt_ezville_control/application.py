@@ -1,13 +1,17 @@
 import asyncio
+import signal
+import sys
 import time
-from queue import Queue
 
 from device_manager import DeviceManager
 from mqtt_client import MQTTClientManager
 from ew11_client import EW11Client
 from packet_processor import PacketProcessor
 from command_handler import CommandHandler
-from constants import HA_TOPIC, EW11_TOPIC
+from router import TopicRouter
+from scheduler import CommandScheduler
+from capture import CaptureWriter, SOURCE_SOCKET, SOURCE_MQTT
+from constants import CAPTURE_FILE, DISCOVERY_REGISTRY_FILE, REFRESH_INTERVAL
 from utils import log
 
 
@@ -18,7 +22,7 @@ class EzvilleApplication:
         self.config = config
         
         # 컴포넌트 초기화
-        self.device_manager = DeviceManager()
+        self.device_manager = DeviceManager(DISCOVERY_REGISTRY_FILE)
         self.mqtt_client = MQTTClientManager(config, self.device_manager)
         
         # 통신 모드에 따라 EW11 클라이언트 초기화
@@ -29,76 +33,114 @@ class EzvilleApplication:
             self.ew11_client = None
         
         self.packet_processor = PacketProcessor(config, self.device_manager, self.mqtt_client)
-        self.command_handler = CommandHandler(config, self.device_manager, self.mqtt_client, self.ew11_client)
+        self.command_handler = CommandHandler(config, self.device_manager, self.mqtt_client, self.ew11_client,
+                                              self.packet_processor.bus_timing)
+        self.router = TopicRouter(self.command_handler.process_ha_command, self.process_recv)
+        
+        # EW11 수신 데이터 Capture 설정
+        if config['capture_mode']:
+            self.capture = CaptureWriter(CAPTURE_FILE, int(config['capture_size'] * 1024 * 1024), config['capture_count'])
+            self.capture_source = SOURCE_SOCKET if self.comm_mode == 'socket' else SOURCE_MQTT
+        else:
+            self.capture = None
         
         # 설정값
-        self.state_loop_delay = config['state_loop_delay']
         self.restart_check_delay = config['restart_check_delay']
         self.reboot_control = config['reboot_control']
         
+        # Warm start 설정
+        self.warm_start = config['warm_start']
+        self.warm_start_timeout = config['warm_start_timeout']
+        
         # 강제 업데이트 설정
         self.force_mode = config['force_update_mode']
         self.force_period = config['force_update_period']
-        self.force_duration = config['force_update_duration']
         
         # 상태 플래그
         self.restart_flag = False
         self.addon_started = False
         self.last_received_time = time.time()
         
-        # 시간 변수
-        self.force_target_time = time.time() + self.force_period
-        self.force_stop_time = self.force_target_time + self.force_duration
-        
-    async def process_message(self):
-        """MQTT message를 분류하여 처리"""
-        while self.mqtt_client.has_messages():
-            msg = self.mqtt_client.get_message()
-            if not msg:
-                break
-                
-            topics = msg.topic.split('/')
+    async def process_message(self, msg):
+        """MQTT message를 topic별 처리 함수로 전달"""
+        route = self.router.resolve(msg.topic)
 
-            if topics[0] == HA_TOPIC and topics[-1] == 'command':
-                await self.command_handler.process_ha_command(topics, msg.payload.decode('utf-8'))
-            elif topics[0] == EW11_TOPIC and topics[-1] == 'recv':
-                # Que에서 확인된 시간 기준으로 EW11 Health Check함.
-                self.last_received_time = time.time()
-                if self.ew11_client:
-                    self.ew11_client.update_receive_time()
+        if route.handler:
+            await route.handler(route, msg.payload)
+    
+    async def process_recv(self, route, payload):
+        """EW11 수신 데이터 처리"""
+        # Que에서 확인된 시간 기준으로 EW11 Health Check함.
+        self.last_received_time = time.time()
+        if self.ew11_client:
+            self.ew11_client.update_receive_time()
+        
+        if self.capture:
+            self.capture.write(payload, self.capture_source)
 
-                await self.packet_processor.process_packet(msg.payload.hex().upper())
+        await self.packet_processor.process_packet(payload)
+    
+    async def load_retained(self):
+        """Broker에 Retain된 Discovery 정보로 등록 정보 확인 (warm_start면 장치 상태도 복원)
+        
+        등록 정보 파일에 있어도 Broker에 Discovery 메시지가 없는 장치 (HA에서 삭제, Broker 초기화 등)는 다시 등록
+        """
+        started = time.time()
+        retained = await self.mqtt_client.collect_retained(self.warm_start_timeout)
+        
+        if retained is None:
+            # Broker를 확인할 수 없으면 등록 정보를 사용하지 않고 모든 장치를 다시 등록
+            log('[WARNING] MQTT 연결 전이라 Discovery 등록 정보를 확인하지 못했습니다. 모든 장치를 다시 등록합니다')
+            self.device_manager.set_registry({})
+            return
+        
+        states, configs = retained
+        restored = self.packet_processor.restore_discovery(configs)
+        
+        if not self.warm_start:
+            log('[INFO] Discovery 등록 확인: 장치 {}개 ({:.2f}초)'.format(restored, time.time() - started))
+            return
+        
+        for key, value in states.items():
+            self.device_manager.set_state(key, value)
+        
+        log('[INFO] Warm start: State {}개, 장치 {}개 복원 ({:.2f}초)'.format(len(states), restored, time.time() - started))
     
     async def state_update_loop(self):
         """상태 업데이트 루프"""
         while True:
-            # 메시지가 있는 동안 계속 처리
-            has_messages = self.mqtt_client.has_messages()
+            # 메시지가 도착할 때까지 대기 (Polling 없이 도착 즉시 처리)
+            msg = await self.mqtt_client.wait_message()
+            await self.process_message(msg)
+            
+            # 이미 도착한 메시지는 대기 없이 모두 처리
+            msg = self.mqtt_client.get_message()
+            while msg:
+                await self.process_message(msg)
+                msg = self.mqtt_client.get_message()
+    
+    async def refresh_loop(self):
+        """강제 상태 갱신 루프 (FORCE_PERIOD 동안 등록된 모든 장치를 나눠서 다시 Publish)"""
+        cursor = 0
+        credit = 0.0
+        
+        while True:
+            await asyncio.sleep(REFRESH_INTERVAL)
             
-            if has_messages:
-                # 메시지가 있으면 모두 처리
-                await self.process_message()
+            entities = [entity for entity in self.device_manager.entities.values()
+                        if self.device_manager.is_discovered(entity.name)]
+            if not entities:
+                continue
             
-            timestamp = time.time()
+            # 매 간격마다 일정한 수의 장치만 다시 Publish (소수점 이하는 다음 간격으로 이월)
+            credit = min(credit + len(entities) * REFRESH_INTERVAL / self.force_period, len(entities))
+            count = int(credit)
+            credit -= count
             
-            # 정해진 시간이 지나면 FORCE 모드 발동
-            if timestamp > self.force_target_time and not self.device_manager.force_update and self.force_mode:
-                self.force_stop_time = timestamp + self.force_duration
-                self.device_manager.force_update = True
-                log('[INFO] 상태 강제 업데이트 실시')
-                
-            # 정해진 시간이 지나면 FORCE 모드 종료    
-            if timestamp > self.force_stop_time and self.device_manager.force_update and self.force_mode:
-                self.force_target_time = timestamp + self.force_period
-                self.device_manager.force_update = False
-                log('[INFO] 상태 강제 업데이트 종료')
-            
-            # 메시지가 있을 때는 짧은 시간(0.001초)만 대기하여 빠르게 처리
-            # 메시지가 없을 때만 STATE_LOOP_DELAY 대기
-            if has_messages:
-                await asyncio.sleep(0.001)  # 1ms 대기로 CPU 과부하 방지
-            else:
-                await asyncio.sleep(self.state_loop_delay)
+            for _ in range(count):
+                cursor %= len(entities)
+                self.mqtt_client.refresh_state(entities[cursor])
+                cursor += 1
     
     async def restart_control(self):
         """EW11 재실행 시 리스타트 실시"""
@@ -117,6 +159,10 @@ class EzvilleApplication:
                 self.mqtt_client.stop()
                 if self.ew11_client:
                     self.ew11_client.close()
+                
+                # Capture 기록 반영 후 파일 닫기 (다음 수신 시 다시 열림)
+                if self.capture:
+                    self.capture.close()
                        
                 # flag 원복
                 self.restart_flag = False
@@ -133,8 +179,27 @@ class EzvilleApplication:
         """재시작 플래그 설정"""
         self.restart_flag = value
     
+    def shutdown(self):
+        """종료 시 MQTT/socket 통신 종료 및 Capture 기록 반영"""
+        log('[INFO] 애드온 종료')
+        self.mqtt_client.stop()
+        if self.ew11_client:
+            self.ew11_client.close()
+        if self.capture:
+            self.capture.close()
+    
     def run(self):
-        """애플리케이션 실행"""
+        """애플리케이션 실행 (종료 시 shutdown 실행)"""
+        # 애드온 정지 (SIGTERM) 시에도 종료 처리가 실행되도록 SystemExit로 변환
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        
+        try:
+            self._run()
+        finally:
+            self.shutdown()
+    
+    def _run(self):
+        """MQTT/socket 통신 및 loop 실행 (재시작 시 초기화 후 다시 실행)"""
         # MQTT 클라이언트 연결
         self.mqtt_client.connect()
         
@@ -142,18 +207,15 @@ class EzvilleApplication:
         loop = asyncio.get_event_loop()
         loop.create_task(self.restart_control())
         
-        # Discovery 및 강제 업데이트 시간 설정
-        self.force_target_time = time.time() + self.force_period
-        self.force_stop_time = self.force_target_time + self.force_duration
-        
         while True:
             # MQTT 통신 시작
             self.mqtt_client.start()
             
             # MQTT Integration의 Birth/Last Will Testament를 기다림 (1초 단위)
+            # (asyncio mode에서도 MQTT 통신이 처리되도록 asyncio loop에서 대기)
             while not self.mqtt_client.mqtt_online and self.reboot_control:
                 log('[INFO] Waiting for MQTT connection')
-                time.sleep(1)
+                loop.run_until_complete(asyncio.sleep(1))
             
             # socket 통신 시작       
             if self.comm_mode in ['mixed', 'socket']:
@@ -164,7 +226,10 @@ class EzvilleApplication:
             tasklist = []
      
             # 필요시 Discovery 등의 지연을 위해 Delay 부여 
-            time.sleep(self.mqtt_client.startup_delay)      
+            loop.run_until_complete(asyncio.sleep(self.mqtt_client.startup_delay))      
+            
+            # Retain된 Discovery 정보 (warm_start면 State도)를 먼저 불러온 후 loop 시작
+            loop.run_until_complete(self.load_retained())
       
             # socket 데이터 수신 loop 실행
             if self.comm_mode == 'socket':
@@ -173,6 +238,13 @@ class EzvilleApplication:
             # EW11 패킷 기반 state 업데이트 loop 실행
             tasklist.append(loop.create_task(self.state_update_loop()))
             
+            # 장치 Discovery loop 실행
+            tasklist.append(loop.create_task(self.packet_processor.discovery_loop()))
+            
+            # 강제 상태 갱신 loop 실행
+            if self.force_mode:
+                tasklist.append(loop.create_task(self.refresh_loop()))
+            
             # Home Assistant 명령 실행 loop 실행
             tasklist.append(loop.create_task(self.command_handler.command_loop()))
             
@@ -192,6 +264,8 @@ class EzvilleApplication:
             self.addon_started = False
             
             # 주요 변수 초기화
-            self.mqtt_client.msg_queue = Queue()
-            self.command_handler.cmd_queue = asyncio.Queue()
+            self.mqtt_client.msg_queue = asyncio.Queue()
+            self.mqtt_client.reset()
+            self.command_handler.scheduler = CommandScheduler()
             self.device_manager.reset()
+            self.packet_processor.reset()
@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+"""
+EW11 수신 데이터 재생 기반 상태 처리 성능 측정
+사용법: python benchmark.py [--capture FILE] [--speed 1|10|0] [--duration 초]
+        python benchmark.py --mqtt HOST [--mqtt-id ID] [--mqtt-password PW] [--count 횟수]
+        python benchmark.py --scene 조명수 [--loss 확률]
+
+Broker/EW11 없이 PacketProcessor -> DeviceManager -> MQTTClientManager까지 실행하고
+MQTTClientManager.publish는 갯수만 세는 stub으로 대체
+--mqtt를 지정하면 실제 Broker로 mqtt_loop_mode(thread/asyncio)별 연결 시간, 왕복 지연, CPU 시간 측정
+--scene을 지정하면 Polling 중인 가상 월패드로 여러 조명 명령의 완료 시간, 첫 전송 ACK 비율, 재전송 횟수를
+순차 처리/lane 처리/lane + bus 유휴 구간 전송별로 측정
+"""
+import argparse
+import asyncio
+import bisect
+import json
+import os
+import random
+import resource
+import time
+
+import utils
+from capture import read_capture
+from command_handler import CommandHandler
+from device_manager import DeviceManager
+from constants import BUS_BYTES_PER_SEC, EW11_SEND_TOPIC, HA_TOPIC
+from mqtt_client import MQTTClientManager
+from packet_processor import PacketProcessor
+
+
+# EW11 버퍼 크기 (한번에 전달되는 최대 byte 수)
+CHUNK_SIZE = 128
+
+# MQTT 왕복 측정용 topic (HA_TOPIC은 항상 구독하므로 그대로 돌아옴)
+PROBE_TOPIC = HA_TOPIC + '/benchmark_00_00/probe/rtt'
+
+# MQTT 연결 후 유휴 상태 CPU 사용량 측정 시간 (초)
+IDLE_DURATION = 5.0
+
+# 가상 월패드의 Room별 조명 갯수 및 명령 수신 후 ACK까지 걸리는 시간 범위 (초)
+SCENE_LIGHTS_PER_ROOM = 3
+SCENE_ACK_DELAY = (0.05, 0.3)
+
+# Scene 측정 중 재생할 월패드 Polling 패킷의 bus 시간, 응답 패킷 뒤 유휴 시간 및 명령 전 통계 수집 시간 (초)
+SCENE_DURATION = 120
+SCENE_POLL_GAP = 0.03
+SCENE_WARMUP = 2.0
+
+
+def make_frame(hex_string):
+    """Header + Data hex 문자열에 XOR/ADD를 붙여 패킷 생성"""
+    return bytes.fromhex(utils.checksum(hex_string + '0000'))
+
+
+def synthetic_frames(duration, seed=0, gap=0.0):
+    """PACKETS.md의 패킷 구조로 만든 월패드 Polling/State 패킷을 (bus 시각, 패킷) 순서로 반환
+
+    gap: 상태 요구 패킷을 제외한 패킷 뒤에 두는 bus 유휴 시간 (초)
+    """
+    rng = random.Random(seed)
+
+    lights = {rid: [rng.randint(0, 1) for _ in range(3)] for rid in range(1, 5)}
+    thermostats = {rid: [rng.choice([1, 2]), rng.randint(18, 26), rng.randint(18, 26)] for rid in range(1, 5)}
+    plugs = {rid: [[1, rng.randint(0, 3000)] for _ in range(2)] for rid in range(1, 3)}
+    batch = 0x04
+
+    timestamp = 0.0
+    while timestamp < duration:
+        frames = []
+
+        # 조명: 상태 요구 + 상태 응답 (에러 상태 + 조명별 상태)
+        for rid, states in lights.items():
+            if rng.random() < 0.02:
+                i = rng.randrange(len(states))
+                states[i] ^= 1
+            frames.append(make_frame('F70E1{:X}0100'.format(rid)))
+            frames.append(make_frame('F70E1{:X}81{:02X}00'.format(rid, len(states) + 1) + ''.join('{:02X}'.format(s) for s in states)))
+
+        # 난방: 상태 요구 + 상태 응답 (상태, 설정 온도, 현재 온도는 BCD)
+        for rid, (mode, set_temp, cur_temp) in thermostats.items():
+            if rng.random() < 0.05:
+                thermostats[rid][2] = min(30, max(10, cur_temp + rng.choice([-1, 1])))
+            mode, set_temp, cur_temp = thermostats[rid]
+            frames.append(make_frame('F7351{:X}0100'.format(rid)))
+            frames.append(make_frame('F7351{:X}810500{:02d}{:02d}00{:02d}'.format(rid, mode, set_temp, cur_temp)))
+
+        # 대기전력: 상태 응답 (갯수 + 플러그별 상태/전력)
+        for rid, outlets in plugs.items():
+            for outlet in outlets:
+                if outlet[0] and rng.random() < 0.5:
+                    outlet[1] = max(0, outlet[1] + rng.randint(-20, 20))
+            frames.append(make_frame('F7501{:X}0100'.format(rid)))
+            frames.append(make_frame('F7501{:X}81{:02X}{:02X}'.format(rid, 1 + 3 * len(outlets), len(outlets))
+                                     + ''.join('{:02X}{:04X}'.format(0x10 | on, power) for on, power in outlets)))
+
+        # 가스밸브, 일괄차단기
+        frames.append(make_frame('F71201810200{:02X}'.format(1)))
+        frames.append(make_frame('F733018103' + '00{:02X}00'.format(batch)))
+
+        for frame in frames:
+            yield timestamp, frame
+            timestamp += len(frame) / BUS_BYTES_PER_SEC
+            if frame[3] != 0x01:
+                timestamp += gap
+
+
+def synthetic_chunks(duration, seed=0, chunk_size=CHUNK_SIZE):
+    """합성 패킷을 EW11처럼 chunk_size 단위로 나눠 (bus 시각, chunk) 순서로 반환"""
+    pending = bytearray()
+    for timestamp, frame in synthetic_frames(duration, seed):
+        pending += frame
+        while len(pending) >= chunk_size:
+            yield timestamp, bytes(pending[:chunk_size])
+            del pending[:chunk_size]
+    if pending:
+        yield duration, bytes(pending)
+
+
+def capture_chunks(path):
+    """Capture 파일의 수신 데이터를 (수신 시각, chunk) 순서로 반환"""
+    start = None
+    for timestamp, source, data in read_capture(path):
+        if start is None:
+            start = timestamp
+        yield timestamp - start, data
+
+
+def load_config():
+    """config.json 기본 옵션에서 로그/Delay를 끈 설정 생성"""
+    with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.json')) as file:
+        config = json.load(file)['options']
+
+    config.update({'DEBUG_LOG': False, 'MQTT_LOG': False, 'EW11_LOG': False, 'discovery_delay': 0})
+    return config
+
+
+def percentile(values, p):
+    """정렬된 목록의 p 백분위 값"""
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * p / 100))]
+
+
+async def run(chunks, speed):
+    """chunk를 재생하며 처리 시간 측정 (speed 0이면 최대 속도)"""
+    config = load_config()
+    device_manager = DeviceManager()
+    mqtt_client = MQTTClientManager(config, device_manager)
+    packet_processor = PacketProcessor(config, device_manager, mqtt_client)
+
+    # Broker 대신 Publish 갯수만 집계
+    published = [0]
+
+    def publish(topic, payload, *args, **kwargs):
+        published[0] += 1
+
+    mqtt_client.publish = publish
+
+    discovery_task = asyncio.ensure_future(packet_processor.discovery_loop())
+
+    latencies = []
+    total_bytes = 0
+    started = time.perf_counter()
+
+    for timestamp, chunk in chunks:
+        if speed > 0:
+            delay = started + timestamp / speed - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        begin = time.perf_counter()
+        await packet_processor.process_packet(chunk)
+        latencies.append(time.perf_counter() - begin)
+        total_bytes += len(chunk)
+
+    # 대기 중인 Discovery 및 State Publish 반영
+    await packet_processor.discovery_queue.join()
+    discovery_task.cancel()
+    mqtt_client.flush()
+
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+
+    return {
+        'chunks': len(latencies),
+        'bytes': total_bytes,
+        'frames': packet_processor.frame_count,
+        'publishes': published[0],
+        'discarded': packet_processor.discarded_bytes,
+        'cache_hits': device_manager.cache_hits,
+        'cache_misses': device_manager.cache_misses,
+        'elapsed': elapsed,
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+        'max_rss': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+async def mqtt_roundtrip(host, mqtt_id, mqtt_password, loop_mode, count):
+    """실제 Broker로 연결 시간, 유휴 CPU 시간, 메시지 왕복 지연 측정"""
+    config = load_config()
+    config.update({'mode': 'mqtt', 'mqtt_server': host, 'mqtt_id': mqtt_id, 'mqtt_password': mqtt_password,
+                   'mqtt_loop_mode': loop_mode, 'reboot_control': False})
+    mqtt_client = MQTTClientManager(config, DeviceManager())
+
+    # 운영 중인 Add-on (mqtt-ezville)의 연결이 끊기지 않도록 별도 client_id 사용
+    started = time.perf_counter()
+    mqtt_client.connect('mqtt-ezville-benchmark-{}'.format(os.getpid()))
+    mqtt_client.start()
+    while not mqtt_client.client.is_connected():
+        if time.perf_counter() - started > 10:
+            raise TimeoutError('MQTT Broker에 연결할 수 없습니다: {}'.format(host))
+        await asyncio.sleep(0.001)
+    startup = time.perf_counter() - started
+
+    # 구독 완료 및 Retain 메시지 수신 대기 후 유휴 상태 CPU 측정
+    await asyncio.sleep(0.5)
+    cpu_started = time.process_time()
+    await asyncio.sleep(IDLE_DURATION)
+    idle_cpu = time.process_time() - cpu_started
+
+    latencies = []
+    cpu_started = time.process_time()
+    for i in range(count):
+        payload = str(i)
+        begin = time.perf_counter()
+        mqtt_client.publish(PROBE_TOPIC, payload)
+        while True:
+            msg = await mqtt_client.wait_message(1.0)
+            if msg is None or (msg.topic == PROBE_TOPIC and msg.payload.decode('utf-8') == payload):
+                break
+        if msg is not None:
+            latencies.append(time.perf_counter() - begin)
+    rtt_cpu = time.process_time() - cpu_started
+
+    mqtt_client.client.disconnect()
+    if mqtt_client.misc_task:
+        mqtt_client.misc_task.cancel()
+    mqtt_client.stop()
+    latencies.sort()
+
+    return {
+        'mode': loop_mode,
+        'startup': startup,
+        'idle_cpu': idle_cpu,
+        'received': len(latencies),
+        'count': count,
+        'rtt_cpu': rtt_cpu,
+        'p50': percentile(latencies, 50),
+        'p99': percentile(latencies, 99),
+    }
+
+
+class WallpadSimulator:
+    """EW11로 전송된 조명 명령을 받아 ACK 패킷으로 응답하는 가상 월패드
+
+    월패드 Polling 패킷을 bus 시각에 맞춰 EW11처럼 CHUNK_SIZE byte 단위로 재생하고,
+    명령이 Polling 패킷과 겹치면(충돌) 명령을 무시
+    충돌하지 않은 명령도 loss 확률로 무시
+    """
+
+    def __init__(self, packet_processor, loss, seed=0):
+        self.packet_processor = packet_processor
+        self.loss = loss
+        self.rng = random.Random(seed)
+        self.lights = {}
+        self.reply_at = {}
+        self.replies = []
+
+        # 재생 중인 Polling 패킷의 bus 점유 구간 (loop 시각)
+        self.starts = []
+        self.ends = []
+
+        # 전송 횟수, 충돌 횟수, 조명별 전송 횟수 및 첫 전송에 성공한 조명
+        self.transmits = 0
+        self.collisions = 0
+        self.attempts = {}
+        self.first_ok = set()
+
+    async def replay(self, frames):
+        """Polling 패킷을 bus 시각에 맞춰 EW11처럼 CHUNK_SIZE byte 단위로 전달 (조명 상태 응답은 현재 조명 상태로 생성)"""
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        self.starts = [started + timestamp for timestamp, frame in frames]
+        self.ends = [start + len(frame) / BUS_BYTES_PER_SEC for start, (timestamp, frame) in zip(self.starts, frames)]
+
+        pending = bytearray()
+        for start, (timestamp, frame) in zip(self.starts, frames):
+            if frame[1] == 0x0E and frame[3] == 0x81:
+                frame = self._light_frame(frame[2] & 0x0F, '81')
+
+            # 응답 대기 중인 ACK는 다음 Polling 패킷 앞에 전송된 것으로 처리
+            while self.replies:
+                pending += self.replies.pop(0)
+
+            offset = 0
+            while len(pending) + len(frame) - offset >= CHUNK_SIZE:
+                size = CHUNK_SIZE - len(pending)
+                pending += frame[offset:offset + size]
+                offset += size
+
+                # chunk의 마지막 byte가 bus에서 전송된 시각에 EW11 수신 데이터로 전달
+                delay = start + offset / BUS_BYTES_PER_SEC - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                await self.packet_processor.process_packet(bytes(pending))
+                pending = bytearray()
+
+            pending += frame[offset:]
+
+    def is_collision(self, start, end):
+        """start ~ end 구간에 Polling 패킷이 bus를 사용하는지 확인"""
+        i = bisect.bisect_left(self.starts, end) - 1
+        return i >= 0 and self.ends[i] > start
+
+    def receive(self, packet):
+        """조명 명령 패킷 처리 후 ACK 패킷 전송 예약"""
+        if packet[1] != 0x0E or packet[3] != 0x41:
+            return
+
+        loop = asyncio.get_running_loop()
+        rid = packet[2] & 0x0F
+        sid = packet[5] & 0x0F
+
+        self.transmits += 1
+        self.attempts[(rid, sid)] = self.attempts.get((rid, sid), 0) + 1
+
+        if self.is_collision(loop.time(), loop.time() + len(packet) / BUS_BYTES_PER_SEC):
+            self.collisions += 1
+            return
+        if self.rng.random() < self.loss:
+            return
+
+        if self.attempts[(rid, sid)] == 1:
+            self.first_ok.add((rid, sid))
+
+        self.lights.setdefault(rid, [0] * SCENE_LIGHTS_PER_ROOM)[sid - 1] = packet[6]
+
+        # 같은 Room의 ACK는 명령을 받은 순서대로 응답
+        self.reply_at[rid] = max(loop.time() + self.rng.uniform(*SCENE_ACK_DELAY), self.reply_at.get(rid, 0))
+        loop.call_at(self.reply_at[rid], self._reply, self._light_frame(rid, 'C1'))
+
+    def _light_frame(self, rid, cmd):
+        """Room의 현재 조명 상태로 상태 응답/ACK 패킷 생성"""
+        states = self.lights.setdefault(rid, [0] * SCENE_LIGHTS_PER_ROOM)
+        return make_frame('F70E1{:X}{}{:02X}00'.format(rid, cmd, len(states) + 1) + ''.join('{:02X}'.format(s) for s in states))
+
+    def _reply(self, ack):
+        """ACK 패킷을 bus 전송 대기 목록에 추가"""
+        self.replies.append(ack)
+
+
+async def run_scene(count, loss, mode, seed=0):
+    """월패드 Polling 중에 조명 count개를 켜는 명령의 완료 시간 및 재전송 횟수 측정
+
+    mode: sequential (기존처럼 한번에 한 명령씩), lanes (장치별 lane), idle (lane + bus 유휴 구간에 전송)
+    """
+    config = load_config()
+    config['mode'] = 'mqtt'
+    device_manager = DeviceManager()
+    mqtt_client = MQTTClientManager(config, device_manager)
+    packet_processor = PacketProcessor(config, device_manager, mqtt_client)
+    bus_timing = packet_processor.bus_timing if mode == 'idle' else None
+    command_handler = CommandHandler(config, device_manager, mqtt_client, bus_timing=bus_timing)
+    wallpad = WallpadSimulator(packet_processor, loss, seed)
+
+    def publish(topic, payload, *args, **kwargs):
+        if topic == EW11_SEND_TOPIC:
+            wallpad.receive(payload)
+
+    mqtt_client.publish = publish
+
+    targets = [(rid, sid) for rid in range(1, 5) for sid in range(1, SCENE_LIGHTS_PER_ROOM + 1)][:count]
+    for rid, sid in targets:
+        device_manager.add_discovery(device_manager.get_entity('light', rid, sid).name)
+
+    # Polling 패킷 재생 후 유휴 시간 통계가 쌓이도록 잠시 대기
+    frames = list(synthetic_frames(SCENE_DURATION, seed, SCENE_POLL_GAP))
+    replay_task = asyncio.ensure_future(wallpad.replay(frames))
+    await asyncio.sleep(SCENE_WARMUP)
+
+    started = time.perf_counter()
+    for rid, sid in targets:
+        name = device_manager.get_entity('light', rid, sid).name
+        await command_handler._handle_light_command('ON', rid, sid, name + 'power')
+
+    if mode == 'sequential':
+        while not command_handler.scheduler.empty():
+            await command_handler.run_command(command_handler.scheduler.get_nowait())
+    else:
+        loop_task = asyncio.ensure_future(command_handler.command_loop())
+        while not command_handler.scheduler.empty() or command_handler.lanes:
+            await asyncio.sleep(0.001)
+        loop_task.cancel()
+    elapsed = time.perf_counter() - started
+    replay_task.cancel()
+
+    confirmed = sum(1 for rid, sid in targets
+                    if device_manager.get_state(device_manager.get_entity('light', rid, sid).name + 'power') == 'ON')
+
+    return {
+        'mode': mode,
+        'commands': len(targets),
+        'confirmed': confirmed,
+        'transmits': wallpad.transmits,
+        'collisions': wallpad.collisions,
+        'first_ok': len(wallpad.first_ok),
+        'elapsed': elapsed,
+    }
+
+
+def report_scene(result):
+    """Scene 측정 결과 출력"""
+    commands = result['commands'] or 1
+    print('[{}]'.format(result['mode']))
+    print('  completion  : {:.2f}s ({} / {} confirmed)'.format(result['elapsed'], result['confirmed'], result['commands']))
+    print('  transmits   : {} ({} collisions)'.format(result['transmits'], result['collisions']))
+    print('  first ACK   : {:.0f}%'.format(result['first_ok'] * 100 / commands))
+    print('  retries/cmd : {:.2f}'.format((result['transmits'] - result['commands']) / commands))
+
+
+def report_mqtt(result):
+    """MQTT 왕복 측정 결과 출력"""
+    print('[{}]'.format(result['mode']))
+    print('  startup     : {:.1f}ms'.format(result['startup'] * 1e3))
+    print('  idle cpu    : {:.2f}ms/s'.format(result['idle_cpu'] * 1e3 / IDLE_DURATION))
+    print('  round trip  : p50 {:.1f}us, p99 {:.1f}us ({} / {} received)'.format(
+        result['p50'] * 1e6, result['p99'] * 1e6, result['received'], result['count']))
+    print('  cpu/msg     : {:.1f}us'.format(result['rtt_cpu'] * 1e6 / (result['count'] or 1)))
+
+
+def report(result):
+    """측정 결과 출력"""
+    elapsed = result['elapsed'] or 1e-9
+    print('chunks        : {} ({} bytes, {} discarded)'.format(result['chunks'], result['bytes'], result['discarded']))
+    print('frames/sec    : {:.0f} ({} frames)'.format(result['frames'] / elapsed, result['frames']))
+    print('publishes/sec : {:.0f} ({} publishes)'.format(result['publishes'] / elapsed, result['publishes']))
+    lookups = result['cache_hits'] + result['cache_misses']
+    print('state repeats : {:.1f}% ({} / {} STATE packets skipped)'.format(
+        result['cache_hits'] * 100 / (lookups or 1), result['cache_hits'], lookups))
+    print('chunk latency : p50 {:.1f}us, p99 {:.1f}us'.format(result['p50'] * 1e6, result['p99'] * 1e6))
+    print('peak RSS      : {} KB'.format(result['max_rss']))
+    print('elapsed       : {:.2f}s'.format(elapsed))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='EW11 수신 데이터 재생 기반 성능 측정')
+    parser.add_argument('--capture', help='capture.py로 기록한 파일 (없으면 합성 데이터 사용)')
+    parser.add_argument('--speed', type=float, default=0, help='재생 배속 (1, 10, 0: 최대 속도)')
+    parser.add_argument('--duration', type=float, default=600, help='합성 데이터의 bus 시간 (초)')
+    parser.add_argument('--seed', type=int, default=0, help='합성 데이터 seed')
+    parser.add_argument('--mqtt', help='MQTT 왕복 측정에 사용할 Broker 주소')
+    parser.add_argument('--mqtt-id', default='', help='MQTT Broker ID')
+    parser.add_argument('--mqtt-password', default='', help='MQTT Broker Password')
+    parser.add_argument('--count', type=int, default=1000, help='MQTT 왕복 측정 횟수')
+    parser.add_argument('--scene', type=int, help='가상 월패드로 완료 시간을 측정할 조명 명령 수')
+    parser.add_argument('--loss', type=float, default=0.2, help='가상 월패드가 명령을 무시할 확률')
+    args = parser.parse_args()
+
+    if args.scene:
+        for mode in ('sequential', 'lanes', 'idle'):
+            report_scene(asyncio.run(run_scene(args.scene, args.loss, mode, args.seed)))
+    elif args.mqtt:
+        for loop_mode in ('thread', 'asyncio'):
+            report_mqtt(asyncio.run(mqtt_roundtrip(args.mqtt, args.mqtt_id, args.mqtt_password, loop_mode, args.count)))
+    else:
+        if args.capture:
+            chunks = capture_chunks(args.capture)
+        else:
+            chunks = synthetic_chunks(args.duration, args.seed)
+
+        report(asyncio.run(run(chunks, args.speed)))
@@ -0,0 +1,141 @@
+import asyncio
+import collections
+
+from constants import BUS_BYTES_PER_SEC
+
+
+class BusTiming:
+    """EW11 수신 시각으로 추정한 패킷 종류 (Device ID, CMD)별 패킷 뒤 유휴 시간 및 다음 유휴 구간
+
+    EW11은 여러 패킷을 모아서 전달하므로 chunk 안의 패킷 사이 유휴 시간은 직접 알 수 없음
+    대신 chunk 사이 시간에서 byte 전송 시간을 뺀 유휴 시간이 그 구간에 끝난 패킷들의 유휴 시간 합이라는 점을 이용해
+    패킷 종류별 유휴 시간을 RLS (Recursive Least Squares)로 추정
+    (요구/응답 패킷이 항상 같이 수신되어 chunk 경계에서만 구분되므로 단순 이동 평균으로는 수렴하지 않음)
+    """
+
+    def __init__(self, variance, noise, drift, max_gap, samples):
+        # 새 패킷 종류의 초기 분산, 수신 시각 오차 분산, 월패드 타이밍 변화를 따라가기 위한 최소 분산
+        # 및 통계에 반영할 최대 유휴 시간 (월패드가 멈춘 시간은 제외)
+        self.variance = variance
+        self.noise = noise
+        self.drift = drift
+        self.max_gap = max_gap
+
+        # 아직 추정에 반영하지 않은 (패킷 종류 목록, 유휴 시간) - 수신 처리를 느리게 하지 않도록 명령 전송 전에 반영
+        self.samples = collections.deque(maxlen=samples)
+
+        # 마지막 chunk 수신 시각 및 그 chunk의 마지막 byte로 끝난 패킷 종류 (뒤의 유휴 시간은 다음 chunk 구간에 포함)
+        self.last_received = None
+        self.carry = None
+
+        # (Device ID, CMD) -> 패킷 뒤 다음 패킷까지의 추정 유휴 시간 (초)
+        self.gaps = {}
+        # 추정 오차 공분산 (패킷 종류 -> 패킷 종류 -> 공분산)
+        self.covariance = {}
+
+        # 다음 유휴 구간 앞의 패킷 종류 및 유휴 구간 예상 시작 시각 (알 수 없으면 None)
+        self.quiet_header = None
+        self.quiet_start = None
+
+        # 다음 chunk를 기다리는 전송 대기자
+        self.waiters = []
+
+    def observe(self, received_time, size, headers, last_header, tail):
+        """EW11 수신 chunk 기록 및 다음 유휴 구간 갱신
+
+        received_time: 수신 시각 (시스템 시계 변경에 영향받지 않도록 time.monotonic() 기준), size: chunk byte 수,
+        headers: chunk 안에서 끝난 패킷 종류 (마지막 byte로 끝난 패킷 제외),
+        last_header: chunk 마지막 byte로 끝난 패킷 종류, tail: chunk 끝에서 전송 중인 패킷의 (종류, 남은 byte 수)
+        """
+        boundaries = headers if self.carry is None else [self.carry] + headers
+
+        if self.last_received is not None and boundaries:
+            # 수신 지연으로 chunk가 몰려서 들어온 경우 (byte 전송 시간보다 짧은 간격)는 통계에서 제외
+            idle = received_time - self.last_received - size / BUS_BYTES_PER_SEC
+            if 0.0 <= idle <= self.max_gap:
+                self.samples.append((boundaries, idle))
+
+        self.last_received = received_time
+        self.carry = last_header
+
+        # 지금 끝났거나 전송 중인 패킷 뒤의 유휴 구간 예상
+        if last_header is not None:
+            self.quiet_header, self.quiet_start = last_header, received_time
+        elif tail is not None:
+            self.quiet_header, self.quiet_start = tail[0], received_time + tail[1] / BUS_BYTES_PER_SEC
+        else:
+            self.quiet_header = self.quiet_start = None
+
+        if self.waiters:
+            for waiter in self.waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+            self.waiters = []
+
+    def update(self):
+        """쌓인 chunk 유휴 시간을 추정에 반영 (유휴 구간 확인 전에 호출)"""
+        while self.samples:
+            self._update(*self.samples.popleft())
+
+    def _update(self, boundaries, idle):
+        """chunk 구간 유휴 시간 = 구간에 끝난 패킷들의 유휴 시간 합으로 RLS 추정 갱신"""
+        counts = {}
+        for header in boundaries:
+            counts[header] = counts.get(header, 0) + 1
+
+        # 처음 보는 패킷 종류는 다른 종류와 상관없이 초기 분산으로 추가
+        for header in counts:
+            if header not in self.gaps:
+                self.gaps[header] = 0.0
+                for row in self.covariance.values():
+                    row[header] = 0.0
+                self.covariance[header] = dict.fromkeys(self.gaps, 0.0)
+                self.covariance[header][header] = self.variance
+
+        gain = {i: sum(row[j] * count for j, count in counts.items()) for i, row in self.covariance.items()}
+        denominator = self.noise + sum(gain[j] * count for j, count in counts.items())
+        error = idle - sum(self.gaps[j] * count for j, count in counts.items())
+
+        for i, row in self.covariance.items():
+            self.gaps[i] += gain[i] * error / denominator
+            for j in row:
+                row[j] -= gain[i] * gain[j] / denominator
+
+        # 분산이 0으로 수렴해 추정이 멈추지 않도록 이번 구간의 패킷 종류는 최소 분산 유지
+        for header in counts:
+            row = self.covariance[header]
+            row[header] = max(row[header], self.drift)
+
+    def quiet_end(self):
+        """다음 유휴 구간의 예상 종료 시각 (알 수 없으면 None)"""
+        gap = self.gaps.get(self.quiet_header)
+        if gap is None or self.quiet_start is None:
+            return None
+        return self.quiet_start + max(gap, 0.0)
+
+    def is_quiet(self, now, duration):
+        """지금부터 duration 동안 월패드 패킷이 없을 것으로 예상되는지 확인 (통계가 없으면 True)"""
+        if not self.gaps:
+            return True
+
+        quiet_end = self.quiet_end()
+        return quiet_end is not None and self.quiet_start <= now and quiet_end - now >= duration
+
+    def next_slot(self, now, duration):
+        """duration 동안 전송할 수 있는 다음 유휴 구간의 시작 시각 (다음 chunk 전까지 없으면 None)"""
+        quiet_end = self.quiet_end()
+        if quiet_end is None:
+            return None
+
+        start = max(now, self.quiet_start)
+        return start if quiet_end - start >= duration else None
+
+    async def wait_chunk(self, timeout):
+        """다음 chunk가 처리될 때까지 대기 (timeout 동안 수신되지 않으면 False)"""
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
@@ -0,0 +1,150 @@
+import asyncio
+import mmap
+import os
+import struct
+import sys
+import time
+
+from utils import log
+
+
+# Capture 파일 식별자
+CAPTURE_MAGIC = b'EZC1'
+
+# 레코드 Header: 수신 시각(double) + 수신 경로(uint8) + 데이터 길이(uint16)
+RECORD_HEADER = struct.Struct('<dBH')
+
+# 버퍼에 쌓인 기록을 파일에 반영하는 주기 (초)
+FLUSH_INTERVAL = 1.0
+
+# 수신 경로
+SOURCE_SOCKET = 0
+SOURCE_MQTT = 1
+
+
+class CaptureWriter:
+    """EW11 수신 데이터를 길이 정보와 함께 binary 파일로 기록하는 클래스"""
+
+    def __init__(self, path, max_bytes, backup_count):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.file = None
+        self.size = 0
+
+        # 기록 후 FLUSH_INTERVAL초 안에 파일에 반영하는 Timer (수신이 멈춰도 마지막 기록까지 반영)
+        self.flush_handle = None
+
+        # 파일 오류 (용량 부족, 권한 등) 발생 시 수신 처리에 영향을 주지 않도록 capture 중단
+        self.disabled = False
+
+    def write(self, data, source):
+        """수신 데이터 1건 기록"""
+        if self.disabled:
+            return
+
+        try:
+            if self.file is None:
+                self._open()
+
+            record_size = RECORD_HEADER.size + len(data)
+            if self.size + record_size > self.max_bytes:
+                self._rotate()
+
+            self.file.write(RECORD_HEADER.pack(time.time(), source, len(data)))
+            self.file.write(data)
+            self.size += record_size
+        except OSError as error:
+            self._disable(error)
+            return
+
+        if self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(FLUSH_INTERVAL, self.flush)
+
+    def flush(self):
+        """버퍼에 쌓인 기록을 파일에 반영"""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+
+        if self.file:
+            try:
+                self.file.flush()
+            except OSError as error:
+                self._disable(error)
+
+    def close(self):
+        """Capture 파일 닫기 (남은 기록 반영 후 닫음)"""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+
+        if self.file:
+            file, self.file = self.file, None
+            try:
+                file.close()
+            except OSError as error:
+                self._disable(error)
+
+    def _disable(self, error):
+        """파일 오류 로그를 한번만 출력하고 capture 중단"""
+        if not self.disabled:
+            log('[WARNING] Capture 파일 기록 실패로 capture를 중단합니다: {}'.format(error))
+        self.disabled = True
+        self.close()
+
+    def _open(self):
+        """Capture 파일 열기 (새 파일이면 식별자 기록)"""
+        self.file = open(self.path, 'ab')
+        self.size = self.file.tell()
+
+        if self.size == 0:
+            self.file.write(CAPTURE_MAGIC)
+            self.size = len(CAPTURE_MAGIC)
+
+    def _rotate(self):
+        """파일 크기 초과 시 path.1 ~ path.N으로 순환 보관"""
+        file, self.file = self.file, None
+        file.close()
+
+        if self.backup_count > 0:
+            for i in range(self.backup_count - 1, 0, -1):
+                src = '{}.{}'.format(self.path, i)
+                if os.path.exists(src):
+                    os.replace(src, '{}.{}'.format(self.path, i + 1))
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+
+        self._open()
+
+
+def read_capture(path):
+    """Capture 파일의 (수신 시각, 수신 경로, 데이터)를 순서대로 반환"""
+    with open(path, 'rb') as file:
+        if os.fstat(file.fileno()).st_size < len(CAPTURE_MAGIC):
+            return
+
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:len(CAPTURE_MAGIC)] != CAPTURE_MAGIC:
+                raise ValueError('Not a capture file: {}'.format(path))
+
+            offset = len(CAPTURE_MAGIC)
+            end = len(mm)
+
+            while offset + RECORD_HEADER.size <= end:
+                timestamp, source, length = RECORD_HEADER.unpack_from(mm, offset)
+                offset += RECORD_HEADER.size
+
+                # 기록 도중 종료되어 잘린 레코드는 무시
+                if offset + length > end:
+                    break
+
+                yield timestamp, source, mm[offset:offset + length]
+                offset += length
+
+
+if __name__ == '__main__':
+    # 사용법: python capture.py <capture 파일>
+    for timestamp, source, data in read_capture(sys.argv[1]):
+        print('{:.3f} {} {}'.format(timestamp, 'socket' if source == SOURCE_SOCKET else 'mqtt', data.hex().upper()))
@@ -1,19 +1,34 @@
 import asyncio
 import random
+import time
 
-from constants import RS485_DEVICE, EW11_SEND_TOPIC
+from constants import RS485_DEVICE, EW11_SEND_TOPIC, BUS_BYTES_PER_SEC, BUS_GUARD_TIME, BUS_IDLE_MAX_WAIT, COMMAND_POLICY
+from scheduler import CommandScheduler, BusArbiter
 from utils import log, checksum
 
 
 class CommandHandler:
     """HA 명령 처리 클래스"""
     
-    def __init__(self, config, device_manager, mqtt_client, ew11_client=None):
+    def __init__(self, config, device_manager, mqtt_client, ew11_client=None, bus_timing=None):
         self.config = config
         self.device_manager = device_manager
         self.mqtt_client = mqtt_client
         self.ew11_client = ew11_client
-        self.cmd_queue = asyncio.Queue()
+        
+        # 월패드 패킷 사이의 유휴 구간에 전송하기 위한 bus 유휴 시간 통계 (없으면 바로 전송)
+        self.bus_timing = bus_timing
+        self.scheduler = CommandScheduler()
+        
+        # 명령 처리 중인 (Device ID, Room) lane 및 처리 task (서로 다른 장치의 명령은 동시에 ACK 대기)
+        self.lanes = {}
+        
+        # State Key별 마지막으로 요청된 명령 및 전송 중인 명령의 ACK Future (같은 State는 마지막 명령만 전송)
+        self.latest_commands = {}
+        self.inflight = {}
+        
+        # RS485 bus에는 한번에 한 패킷만 전송 (동시에 전송하려는 lane은 우선순위 순서대로 전송)
+        self.bus = BusArbiter()
         
         # 설정값
         self.debug = config['DEBUG_LOG']
@@ -24,27 +39,28 @@ class CommandHandler:
         self.cmd_retry_count = config['command_retry_count']
         self.first_waittime = config['first_waittime']
         self.random_backoff = config['random_backoff']
-        self.command_loop_delay = config['command_loop_delay']
         
-    async def process_ha_command(self, topics, value):
-        """HA에서 전달된 메시지 처리"""
-        device_info = topics[1].split('_')
-        device = device_info[0]
+    async def process_ha_command(self, route, payload):
+        """HA에서 전달된 메시지 처리 (route: TopicRouter가 분석한 명령 topic 정보)"""
+        value = payload.decode('utf-8')
         
         if self.mqtt_log:
-            log('[LOG] HA ->> : {} -> {}'.format('/'.join(topics), value))
+            log('[LOG] HA ->> : {} -> {}'.format(route.topic, value))
 
-        if device in RS485_DEVICE:
-            key = topics[1] + topics[2]
-            idx = int(device_info[1])
-            sid = int(device_info[2])
+        if route.device is not None:
+            device = route.device
+            key = route.key
+            idx = route.room
+            sid = route.index
             cur_state = self.device_manager.get_state(key)
             
-            if value == cur_state:
+            # 이전 값으로 되돌린 경우 아직 전송하지 않은 명령만 삭제 (이미 전송 중이면 되돌린 값도 명령으로 전송)
+            if value == cur_state and key not in self.inflight:
+                self.discard_command(key)
                 return
             else:
                 if device == 'thermostat':
-                    await self._handle_thermostat_command(topics, value, idx, sid, key)
+                    await self._handle_thermostat_command(route.attribute, value, idx, sid, key)
                 elif device == 'light':
                     await self._handle_light_command(value, idx, sid, key)
                 elif device == 'plug':
@@ -52,19 +68,38 @@ class CommandHandler:
                 elif device == 'gasvalve':
                     await self._handle_gasvalve_command(value, idx, key)
                 elif device == 'batch':
-                    await self._handle_batch_command(topics, idx, key)
+                    await self._handle_batch_command(route.name, route.attribute, idx, key)
+    
+    def queue_command(self, device, send_data):
+        """명령을 장치별 우선순위로 Scheduler에 추가 (같은 State의 이전 명령은 대기 중이면 건너뛰고 전송 중이면 중단)"""
+        policy = COMMAND_POLICY[device]
+        send_data['priority'] = policy['priority']
+        send_data['deadline'] = time.monotonic() + policy['deadline']
+        
+        key = send_data['statcmd'][0]
+        self.discard_command(key)
+        self.latest_commands[key] = send_data
+        self.scheduler.put(policy['priority'], send_data)
+    
+    def discard_command(self, key):
+        """State Key의 대기 중인 명령 삭제 및 전송 중인 명령은 현재 전송 후 재전송 중단"""
+        self.latest_commands.pop(key, None)
+        
+        ack = self.inflight.get(key)
+        if ack is not None:
+            ack.cancel()
     
-    async def _handle_thermostat_command(self, topics, value, idx, sid, key):
+    async def _handle_thermostat_command(self, attribute, value, idx, sid, key):
         """온도조절기 명령 처리"""
         device = 'thermostat'
         
-        if topics[2] == 'power':
+        if attribute == 'power':
             if value == 'heat':
                 sendcmd = checksum('F7' + RS485_DEVICE[device]['power']['id'] + '1' + str(idx) + RS485_DEVICE[device]['power']['cmd'] + '01010000')
                 recvcmd = 'F7' + RS485_DEVICE[device]['power']['id'] + '1' + str(idx) + RS485_DEVICE[device]['power']['ack']
                 statcmd = [key, value]
                
-                await self.cmd_queue.put({'sendcmd': sendcmd, 'recvcmd': recvcmd, 'statcmd': statcmd})
+                self.queue_command(device, {'sendcmd': sendcmd, 'recvcmd': recvcmd, 'statcmd': statcmd})
             
             # Thermostat는 외출 모드를 Off 모드로 연결
             elif value == 'off':
@@ -72,12 +107,12 @@ class CommandHandler:
                 recvcmd = 'F7' + RS485_DEVICE[device]['away']['id'] + '1' + str(idx) + RS485_DEVICE[device]['away']['ack']
                 statcmd = [key, value]
                
-                await self.cmd_queue.put({'sendcmd': sendcmd, 'recvcmd': recvcmd, 'statcmd': statcmd})
+                self.queue_command(device, {'sendcmd': sendcmd, 'recvcmd': recvcmd, 'statcmd': statcmd})
                                         
             if self.debug:
                 log('[DEBUG] Queued ::: sendcmd: {}, recvcmd: {}, statcmd: {}'.format(sendcmd, recvcmd, statcmd))
                             
-        elif topics[2] == 'setTemp':
+        elif attribute == 'setTemp':
             value = int(float(value))
             
             # BCD encoding for temperature (e.g., 14 -> "14")
@@ -88,7 +123,7 @@ class CommandHandler:
             recvcmd = 'F7' + RS485_DEVICE[device]['target']['id'] + '1' + str(idx) + RS485_DEVICE[device]['target']['ack']
             statcmd = [key, str(value)]
 
-            await self.cmd_queue.put({'sendcmd': sendcmd, 'recvcmd': recvcmd, 'statcmd': statcmd})
+            self.queue_command(device, {'sendcmd': sendcmd, 'recvcmd': recvcmd, 'statcmd': statcmd})
                    
             if self.debug:
                 log('[DEBUG] Queued ::: sendcmd: {}, recvcmd: {}, statcmd: {}'.format(sendcmd, recvcmd, statcmd))
@@ -102,7 +137,7 @@ class CommandHandler:
         recvcmd = 'F7' + RS485_DEVICE[device]['power']['id'] + '1' + str(idx) + RS485_DEVICE[device]['power']['ack']
         statcmd = [key, value]
         
-        await self.cmd_queue.put({'sendcmd': sendcmd, 'recvcmd': recvcmd, 'statcmd': statcmd})
+        self.queue_command(device, {'sendcmd': sendcmd, 'recvcmd': recvcmd, 'statcmd': statcmd})
                    
         if self.debug:
             log('[DEBUG] Queued ::: sendcmd: {}, recvcmd: {}, statcmd: {}'.format(sendcmd, recvcmd, statcmd))
@@ -116,7 +151,7 @@ class CommandHandler:
         recvcmd = 'F7' + RS485_DEVICE[device]['power']['id'] + '1' + str(idx) + RS485_DEVICE[device]['power']['ack']
         statcmd = [key, value]
             
-        await self.cmd_queue.put({'sendcmd': sendcmd, 'recvcmd': recvcmd, 'statcmd': statcmd})
+        self.queue_command(device, {'sendcmd': sendcmd, 'recvcmd': recvcmd, 'statcmd': statcmd})
                    
         if self.debug:
             log('[DEBUG] Queued ::: sendcmd: {}, recvcmd: {}, statcmd: {}'.format(sendcmd, recvcmd, statcmd))
@@ -130,29 +165,29 @@ class CommandHandler:
             recvcmd = ['F7' + RS485_DEVICE[device]['power']['id'] + '1' + str(idx) + RS485_DEVICE[device]['power']['ack']]
             statcmd = [key, value]
 
-            await self.cmd_queue.put({'sendcmd': sendcmd, 'recvcmd': recvcmd, 'statcmd': statcmd})
+            self.queue_command(device, {'sendcmd': sendcmd, 'recvcmd': recvcmd, 'statcmd': statcmd})
                    
             if self.debug:
                 log('[DEBUG] Queued ::: sendcmd: {}, recvcmd: {}, statcmd: {}'.format(sendcmd, recvcmd, statcmd))
     
-    async def _handle_batch_command(self, topics, idx, key):
+    async def _handle_batch_command(self, name, attribute, idx, key):
         """일괄차단기 명령 처리"""
         device = 'batch'
         # Batch는 Elevator 및 외출/그룹 조명 버튼 상태 고려 
-        elup_state = '1' if self.device_manager.get_state(topics[1] + 'elevator-up') == 'ON' else '0'
-        eldown_state = '1' if self.device_manager.get_state(topics[1] + 'elevator-down') == 'ON' else '0'
-        out_state = '1' if self.device_manager.get_state(topics[1] + 'outing') == 'ON' else '0'
-        group_state = '1' if self.device_manager.get_state(topics[1] + 'group') == 'ON' else '0'
+        elup_state = '1' if self.device_manager.get_state(name + 'elevator-up') == 'ON' else '0'
+        eldown_state = '1' if self.device_manager.get_state(name + 'elevator-down') == 'ON' else '0'
+        out_state = '1' if self.device_manager.get_state(name + 'outing') == 'ON' else '0'
+        group_state = '1' if self.device_manager.get_state(name + 'group') == 'ON' else '0'
 
         # 일괄 차단기는 4가지 모드로 조절               
-        if topics[2] == 'elevator-up':
+        if attribute == 'elevator-up':
             elup_state = '1'
-        elif topics[2] == 'elevator-down':
+        elif attribute == 'elevator-down':
             eldown_state = '1'
 # 그룹 조명과 외출 모드 설정은 테스트 후에 추가 구현                                                
-#                    elif topics[2] == 'group':
+#                    elif attribute == 'group':
 #                        group_state = '1'
-#                    elif topics[2] == 'outing':
+#                    elif attribute == 'outing':
 #                        out_state = '1'
                     
         CMD = '{:0>2X}'.format(int('00' + eldown_state + elup_state + '0' + group_state + out_state + '0', 2))
@@ -163,74 +198,176 @@ class CommandHandler:
         recvcmd = 'NULL'
         statcmd = [key, 'NULL']
         
-        await self.cmd_queue.put({'sendcmd': sendcmd, 'recvcmd': recvcmd, 'statcmd': statcmd})
+        self.queue_command(device, {'sendcmd': sendcmd, 'recvcmd': recvcmd, 'statcmd': statcmd})
         
         if self.debug:
             log('[DEBUG] Queued ::: sendcmd: {}, recvcmd: {}, statcmd: {}'.format(sendcmd, recvcmd, statcmd))
     
     async def send_to_ew11(self, send_data):
         """HA에서 전달된 명령을 EW11 패킷으로 전송"""
-        # 0.05초 간격으로 상태 확인 (20Hz polling)
-        # 수신 패킷 처리에 더 많은 시간을 할애
-        POLLING_INTERVAL = 0.05
-        
-        for i in range(self.cmd_retry_count):
-            if self.ew11_log:
-                log('[SIGNAL] 신호 전송: {}'.format(send_data))
-                        
-            if self.comm_mode == 'mqtt':
-                self.mqtt_client.publish(EW11_SEND_TOPIC, bytes.fromhex(send_data['sendcmd']))
-            else:
-                if self.ew11_client:
-                    self.ew11_client.send(send_data['sendcmd'])
-            
-            if self.debug:
-                log('[DEBUG] Iter. No.: ' + str(i + 1) + ', Target: ' + send_data['statcmd'][1] + ', Current: ' + str(self.device_manager.get_state(send_data['statcmd'][0])))
-              
-            # Ack나 State 업데이트가 불가한 경우 한번만 명령 전송 후 Return
-            if send_data['statcmd'][1] == 'NULL':
-                return
-      
-            # 대기 시간 계산
-            if i == 0:
-                wait_time = self.first_waittime
-            else:
-                if self.random_backoff:
-                    wait_time = random.randint(0, int(self.cmd_interval * 1000))/1000
+        key, target = send_data['statcmd']
+        
+        # ACK/STATE 패킷 Header의 Device ID (송신 패킷과 동일)
+        device_id = int(send_data['sendcmd'][2:4], 16)
+        
+        # Ack나 State 업데이트가 불가한 경우 확인 대기 없이 한번만 명령 전송
+        ack = None if target == 'NULL' else self.device_manager.expect_state(device_id, key, target)
+        if ack is not None:
+            self.inflight[key] = ack
+        
+        # 전송 중인 명령을 되돌린 경우처럼 전송 전부터 State가 목표 값이면 ACK/STATE 패킷으로만 완료 확인
+        check_state = self.device_manager.get_state(key) != target
+        
+        try:
+            for i in range(self.cmd_retry_count):
+                # 기한이 지난 명령은 재전송하지 않음
+                if self.is_expired(send_data):
+                    return
+                
+                if self.ew11_log:
+                    log('[SIGNAL] 신호 전송: {}'.format(send_data))
+                            
+                await self.transmit(send_data['sendcmd'], send_data['priority'])
+                
+                if self.debug:
+                    log('[DEBUG] Iter. No.: ' + str(i + 1) + ', Target: ' + target + ', Current: ' + str(self.device_manager.get_state(key)))
+                  
+                if ack is None:
+                    return
+          
+                # 대기 시간 계산
+                if i == 0:
+                    wait_time = self.first_waittime
                 else:
-                    wait_time = self.cmd_interval
-            
-            # 짧은 간격으로 폴링하면서 상태 확인
-            # 이렇게 하면 ACK 대기 중에도 수신 패킷이 처리됨
-            elapsed_time = 0
-            poll_count = 0
-            while elapsed_time < wait_time:
-                await asyncio.sleep(POLLING_INTERVAL)
-                elapsed_time += POLLING_INTERVAL
-                poll_count += 1
+                    if self.random_backoff:
+                        wait_time = random.randint(0, int(self.cmd_interval * 1000))/1000
+                    else:
+                        wait_time = self.cmd_interval
+                
+                # PacketProcessor가 확인 패킷을 해석하는 즉시 완료되므로 Polling 없이 대기
+                started = time.monotonic()
+                if not ack.done() and not (check_state and self.device_manager.get_state(key) == target):
+                    await asyncio.wait((ack,), timeout=wait_time)
                 
-                # 상태가 변경되었는지 확인
-                current_state = self.device_manager.get_state(send_data['statcmd'][0])
-                if send_data['statcmd'][1] == current_state:
+                # 같은 State의 새 명령이 들어오면 재전송하지 않음
+                if ack.cancelled():
                     if self.debug:
-                        log('[DEBUG] ACK received after {:.2f}s ({} polls)'.format(elapsed_time, poll_count))
+                        log('[DEBUG] Superseded ::: {}'.format(send_data))
                     return
                 
-                # 5번 폴링마다 현재 상태 로그
-                if self.debug and poll_count % 5 == 0:
-                    log('[DEBUG] Polling... Target: {}, Current: {}, Elapsed: {:.2f}s'.format(
-                        send_data['statcmd'][1], current_state, elapsed_time))
+                if ack.done() or (check_state and self.device_manager.get_state(key) == target):
+                    if self.debug:
+                        log('[DEBUG] ACK received after {:.3f}s'.format(time.monotonic() - started))
+                    return
+        finally:
+            if ack is not None:
+                self.device_manager.cancel_expect(device_id, key, ack)
+                if self.inflight.get(key) is ack:
+                    del self.inflight[key]
 
         if self.ew11_log:
             log('[SIGNAL] {}회 명령을 재전송하였으나 수행에 실패했습니다.. 다음의 Queue 삭제: {}'.format(str(self.cmd_retry_count), send_data))
             return
     
-    async def command_loop(self):
-        """명령 처리 루프"""
+    def is_expired(self, send_data):
+        """명령 기한이 지났는지 확인 (기한이 지난 명령은 로그 출력)"""
+        if time.monotonic() <= send_data['deadline']:
+            return False
+        
+        log('[WARNING] 명령 기한이 지나 삭제합니다: {}'.format(send_data))
+        return True
+    
+    async def transmit(self, sendcmd, priority):
+        """패킷 전송 (월패드 패킷 사이의 유휴 구간에 전송하고, 다른 lane의 패킷과 겹치지 않도록 전송 시간 동안 bus 점유)"""
+        frame_time = len(sendcmd) / 2 / BUS_BYTES_PER_SEC
+        deadline = time.monotonic() + BUS_IDLE_MAX_WAIT
+        
+        while True:
+            # 유휴 구간은 bus를 점유하지 않고 기다림 (기다리는 동안 다른 lane은 전송 가능)
+            if self.bus_timing is not None:
+                await self.wait_bus_idle(frame_time, deadline)
+            
+            await self.bus.acquire(priority)
+            
+            # 다른 lane의 전송을 기다리는 동안 유휴 구간이 지나갔으면 다시 대기
+            now = time.monotonic()
+            if self.bus_timing is None or now >= deadline or self.bus_timing.is_quiet(now, frame_time + BUS_GUARD_TIME):
+                break
+            self.bus.release()
+        
+        try:
+            if self.comm_mode == 'mqtt':
+                self.mqtt_client.publish(EW11_SEND_TOPIC, bytes.fromhex(sendcmd))
+            else:
+                if self.ew11_client:
+                    self.ew11_client.send(sendcmd)
+            
+            await asyncio.sleep(frame_time)
+        finally:
+            self.bus.release()
+    
+    async def wait_bus_idle(self, frame_time, deadline):
+        """패킷 전송이 끝날 때까지 월패드 패킷이 없을 것으로 예상되는 유휴 구간까지 대기
+        
+        현재 수신 중인 패킷 뒤의 추정 유휴 시간이 충분하면 그 시작 시각까지 기다리고, 부족하면 다음 수신 데이터를 처리한 직후 다시 확인
+        deadline까지 유휴 구간을 찾지 못하거나 수신 데이터가 없으면 바로 전송
+        """
+        duration = frame_time + BUS_GUARD_TIME
+        
         while True:
-            if not self.cmd_queue.empty():
-                send_data = await self.cmd_queue.get()
-                await self.send_to_ew11(send_data)               
+            self.bus_timing.update()
+            
+            now = time.monotonic()
+            if now >= deadline or self.bus_timing.is_quiet(now, duration):
+                return
             
-            # COMMAND_LOOP_DELAY 초 대기 후 루프 진행
-            await asyncio.sleep(self.command_loop_delay)
+            slot = self.bus_timing.next_slot(now, duration)
+            if slot is not None:
+                await asyncio.sleep(min(slot, deadline) - now)
+            elif not await self.bus_timing.wait_chunk(deadline - now):
+                return
+    
+    async def run_command(self, send_data):
+        """Queue에서 꺼낸 명령 전송 (같은 State의 새 명령으로 대체된 명령은 건너뜀)"""
+        key = send_data['statcmd'][0]
+        if self.latest_commands.get(key) is not send_data:
+            return
+        
+        del self.latest_commands[key]
+        if not self.is_expired(send_data):
+            await self.send_to_ew11(send_data)
+    
+    def lane_key(self, send_data):
+        """명령의 (Device ID, Room) lane"""
+        return send_data['sendcmd'][2:6]
+    
+    def is_lane_free(self, send_data):
+        """명령의 lane에서 처리 중인 명령이 없는지 확인"""
+        return self.lane_key(send_data) not in self.lanes
+    
+    def dispatch(self, send_data):
+        """명령을 처리하는 동안 lane 점유"""
+        lane_key = self.lane_key(send_data)
+        self.lanes[lane_key] = asyncio.ensure_future(self.lane_command(lane_key, send_data))
+    
+    async def lane_command(self, lane_key, send_data):
+        """명령 처리 후 lane을 비우고 Scheduler에서 다음 명령을 고르도록 알림"""
+        try:
+            await self.run_command(send_data)
+        finally:
+            self.lanes.pop(lane_key, None)
+            self.scheduler.wake()
+    
+    async def command_loop(self):
+        """명령 처리 루프"""
+        try:
+            while True:
+                # lane이 비어 있는 명령 중 우선순위가 가장 높은 명령을 기다렸다가 처리 시작
+                # (lane이 사용 중인 명령은 Scheduler에 남아 우선순위 순서대로 대기)
+                self.dispatch(await self.scheduler.get(self.is_lane_free))
+        finally:
+            # 재시작 시 처리 중인 명령도 함께 종료
+            for task in self.lanes.values():
+                task.cancel()
+            self.lanes = {}
+            self.latest_commands = {}
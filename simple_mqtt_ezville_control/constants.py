@@ -122,26 +122,78 @@ DISCOVERY_PAYLOAD = {
     } ]
 }
 
-# STATE 확인용 Dictionary
-STATE_HEADER = {
-    prop['state']['id']: (device, prop['state']['cmd'])
-    for device, prop in RS485_DEVICE.items()
-    if 'state' in prop
-}
+# RS485 9600bps 기준 초당 전송 byte 수 (start/stop bit 포함 10bit)
+BUS_BYTES_PER_SEC = 960
 
-# ACK 확인용 Dictionary
-ACK_HEADER = {
-    prop[cmd]['id']: (device, prop[cmd]['ack'])
-    for device, prop in RS485_DEVICE.items()
-        for cmd, code in prop.items()
-            if 'ack' in code
-}
+# 명령 전송 시 월패드 패킷과 겹치지 않도록 두는 여유 시간 (초)
+BUS_GUARD_TIME = 0.005
+
+# 명령 전송 전 유휴 구간을 기다리는 최대 시간 (초, 이 시간 동안 유휴 구간을 찾지 못하면 바로 전송)
+BUS_IDLE_MAX_WAIT = 1.0
+
+# 패킷 종류별 유휴 시간 추정의 초기 분산, chunk 수신 시각 오차 분산, 월패드 타이밍 변화를 따라가기 위한 최소 분산 (초^2)
+# 및 통계에 반영할 chunk당 최대 유휴 시간 (초)
+BUS_GAP_VARIANCE = 0.01
+BUS_GAP_NOISE = 1e-6
+BUS_GAP_DRIFT = 1e-6
+BUS_GAP_MAX = 1.0
+
+# 명령 전송 전에 유휴 시간 추정에 반영할 최근 chunk 수 (그 이전 chunk는 반영하지 않고 버림)
+BUS_GAP_SAMPLES = 64
+
+# EW11 수신 버퍼 최대 크기 (bytes)
+FRAME_BUFFER_SIZE = 1024
+
+# 자주 Publish되는 State 값의 미리 encode된 Payload
+ENCODED_PAYLOAD = {value: value.encode() for value in ('ON', 'OFF', 'heat', 'off')}
+
+# State Publish를 모아서 보내는 최대 지연 시간 (초)
+PUBLISH_BATCH_DELAY = 0.005
 
 # MQTT Topics
 HA_TOPIC = 'ezville'
 STATE_TOPIC = HA_TOPIC + '/{}/{}/state'
 EW11_TOPIC = 'ew11'
 EW11_SEND_TOPIC = EW11_TOPIC + '/send'
+DISCOVERY_TOPIC = 'homeassistant/{}/ezville_wallpad/{}/config'
+DISCOVERY_SUBSCRIBE_TOPIC = DISCOVERY_TOPIC.format('+', '+')
+
+# 장치/State별 Publish 제한 정책 (자주 바뀌는 값이 Broker/HA Recorder에 과도하게 기록되지 않도록 함)
+#   deadband: 마지막 Publish 값과의 차이가 이 값 미만이면 Publish하지 않음
+#   relative_deadband: 마지막 Publish 값 대비 변화율이 이 값 미만이면 Publish하지 않음
+#   min_interval: 마지막 Publish 후 이 시간(초) 안에는 Publish하지 않음 (이후 마지막 값 Publish)
+#   max_staleness: Publish하지 않은 변경 값이 있으면 마지막 Publish 후 이 시간(초)이 지나면 Publish
+PUBLISH_POLICY = {
+    'plug': {
+        'current': { 'deadband': 1.0, 'relative_deadband': 0.05, 'min_interval': 5, 'max_staleness': 60 }
+    }
+}
+
+# 장치별 HA 명령 처리 정책
+#   priority: 값이 작을수록 먼저 처리 (bus 전송 대기 시에도 적용)
+#   deadline: 명령을 받은 후 이 시간(초)이 지나도록 확인되지 않으면 재전송하지 않고 삭제
+COMMAND_POLICY = {
+    'gasvalve':   { 'priority': 0, 'deadline': 60 },
+    'batch':      { 'priority': 0, 'deadline': 10 },
+    'thermostat': { 'priority': 1, 'deadline': 30 },
+    'light':      { 'priority': 2, 'deadline': 15 },
+    'plug':       { 'priority': 2, 'deadline': 15 }
+}
+
+# 강제 상태 갱신 시 일부 장치씩 다시 Publish하는 간격 (초)
+REFRESH_INTERVAL = 1.0
+
+# mqtt_loop_mode가 asyncio일 때 paho keepalive/재연결 확인 주기 (초)
+MQTT_MISC_INTERVAL = 1.0
+
+# Warm start 시 Retain 메시지가 이 시간(초) 동안 더 오지 않으면 수집 종료
+WARM_START_IDLE = 0.2
 
 # Configuration directory
 CONFIG_DIR = '/data'
+
+# MQTT Discovery 등록 정보 파일
+DISCOVERY_REGISTRY_FILE = CONFIG_DIR + '/discovery.json'
+
+# EW11 수신 데이터 Capture 파일
+CAPTURE_FILE = '/share/ezville_capture.bin'
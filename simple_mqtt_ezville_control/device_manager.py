@@ -1,22 +1,72 @@
+import asyncio
+import json
+import os
+
+from constants import DISCOVERY_PAYLOAD, STATE_TOPIC
+from utils import log
+
+
+# 장치별 State 목록 (Discovery Payload의 State Topic에서 추출)
+DEVICE_STATES = {
+    device: [
+        value.split('/')[1]
+        for payload in payloads
+            for key, value in payload.items()
+                if key.endswith('_t') and value.endswith('/state')
+    ]
+    for device, payloads in DISCOVERY_PAYLOAD.items()
+}
+
+
+class Entity:
+    """장치별 Discovery 이름, State Key, State Topic을 미리 계산해둔 정보"""
+    
+    def __init__(self, device, rid, idx):
+        self.device = device
+        self.rid = rid
+        self.idx = idx
+        
+        # Discovery 이름 (State Key/Topic의 장치 ID)
+        self.name = '{}_{:0>2d}_{:0>2d}'.format(device, rid, idx)
+        
+        # State 이름 -> (State Key, State Topic)
+        self.states = {}
+        for state in DEVICE_STATES.get(device, []):
+            self.state(state)
+    
+    def state(self, state):
+        """State Key 및 State Topic 조회 (목록에 없는 State는 처음 사용 시 생성)"""
+        handle = self.states.get(state)
+        if handle is None:
+            handle = self.states[state] = (self.name + state, STATE_TOPIC.format(self.name, state))
+        return handle
+
+
 class DeviceManager:
     """디바이스 상태 및 캐시 관리 클래스"""
     
-    def __init__(self):
+    def __init__(self, registry_path=None):
         # State 저장용 공간
         self.device_state = {}
         
-        # 이전에 전달된 패킷인지 판단을 위한 캐시
+        # 이전에 전달된 패킷인지 판단을 위한 캐시 (Header -> Data)
         self.msg_cache = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
         
-        # MQTT Discovery List
-        self.discovery_list = []
+        # (장치, Room ID, 장치 번호) -> Entity
+        self.entities = {}
         
-        # EW11 전달 패킷 중 처리 후 남은 짜투리 패킷 저장
-        self.residue = ''
+        # MQTT Discovery List (이번 실행에서 등록 확인된 장치)
+        self.discovery_list = set()
         
-        # 강제 업데이트 플래그
-        self.force_update = False
+        # 등록된 장치별 Discovery Payload hash (재시작 후에도 유지되도록 파일에 저장)
+        self.registry_path = registry_path
+        self.discovery_registry = self._load_registry()
         
+        # 확인 대기 중인 명령 (Device ID -> State Key -> (목표 값, Future))
+        self.ack_waiters = {}
+    
     def get_state(self, key):
         """디바이스 상태 조회"""
         return self.device_state.get(key)
@@ -25,9 +75,48 @@ class DeviceManager:
         """디바이스 상태 설정"""
         self.device_state[key] = value
     
+    def get_entity(self, device, rid, idx):
+        """장치 정보 조회 (처음 확인된 장치는 생성)"""
+        entity = self.entities.get((device, rid, idx))
+        if entity is None:
+            entity = self.entities[(device, rid, idx)] = Entity(device, rid, idx)
+        return entity
+    
+    def expect_state(self, device_id, key, value):
+        """Device ID의 ACK/STATE 패킷으로 State Key가 value가 되면 완료되는 Future 등록"""
+        future = asyncio.get_running_loop().create_future()
+        self.ack_waiters.setdefault(device_id, {})[key] = (value, future)
+        return future
+    
+    def cancel_expect(self, device_id, key, future):
+        """확인 대기 등록 해제 (같은 State Key로 새로 등록된 Future는 유지)"""
+        waiters = self.ack_waiters.get(device_id)
+        if waiters is None or waiters.get(key, (None, None))[1] is not future:
+            return
+        
+        del waiters[key]
+        if not waiters:
+            del self.ack_waiters[device_id]
+    
+    def resolve_states(self, device_id, changes):
+        """해석된 패킷의 State 중 확인 대기 중인 목표 값과 같은 명령 완료 처리"""
+        waiters = self.ack_waiters.get(device_id)
+        if not waiters:
+            return
+        
+        for entity, state, value in changes:
+            waiter = waiters.get(entity.state(state)[0])
+            if waiter is not None and waiter[0] == value and not waiter[1].done():
+                waiter[1].set_result(value)
+    
     def is_cached(self, packet_key, packet_data):
-        """패킷이 캐시되어 있는지 확인"""
-        return self.msg_cache.get(packet_key) == packet_data
+        """패킷이 캐시되어 있는지 확인 (Hit/Miss 횟수 집계)"""
+        if self.msg_cache.get(packet_key) == packet_data:
+            self.cache_hits += 1
+            return True
+        
+        self.cache_misses += 1
+        return False
     
     def cache_packet(self, packet_key, packet_data):
         """패킷을 캐시에 저장"""
@@ -37,27 +126,56 @@ class DeviceManager:
         """디바이스가 discovery 되었는지 확인"""
         return discovery_name in self.discovery_list
     
-    def add_discovery(self, discovery_name):
+    def add_discovery(self, discovery_name, payload_hash=None):
         """디바이스를 discovery 목록에 추가"""
-        if discovery_name not in self.discovery_list:
-            self.discovery_list.append(discovery_name)
+        self.discovery_list.add(discovery_name)
+        
+        if payload_hash is not None and self.discovery_registry.get(discovery_name) != payload_hash:
+            self.discovery_registry[discovery_name] = payload_hash
+            self._save_registry()
     
-    def get_residue(self):
-        """남은 패킷 데이터 조회"""
-        return self.residue
+    def set_registry(self, registry):
+        """등록 정보를 Broker에서 확인된 장치 {이름: Payload hash}로 교체 (나머지 장치는 다음에 확인될 때 다시 discovery)"""
+        for discovery_name in self.discovery_registry.keys() - registry.keys():
+            self.discovery_list.discard(discovery_name)
+        self.discovery_list.update(registry)
+        
+        if registry != self.discovery_registry:
+            self.discovery_registry = dict(registry)
+            self._save_registry()
     
-    def set_residue(self, data):
-        """남은 패킷 데이터 설정"""
-        self.residue = data
+    def _load_registry(self):
+        """Discovery 등록 정보 파일 로드"""
+        if not self.registry_path or not os.path.exists(self.registry_path):
+            return {}
+        
+        try:
+            with open(self.registry_path) as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            log('[WARNING] Discovery 등록 정보 로드 실패: {}'.format(e))
+            return {}
     
-    def clear_residue(self):
-        """남은 패킷 데이터 초기화"""
-        self.residue = ''
+    def _save_registry(self):
+        """Discovery 등록 정보 파일 저장"""
+        if not self.registry_path:
+            return
         
+        try:
+            tmp_path = self.registry_path + '.tmp'
+            with open(tmp_path, 'w') as file:
+                json.dump(self.discovery_registry, file)
+            os.replace(tmp_path, self.registry_path)
+        except OSError as e:
+            log('[WARNING] Discovery 등록 정보 저장 실패: {}'.format(e))
+    
     def reset(self):
         """모든 상태 초기화"""
         self.device_state = {}
         self.msg_cache = {}
-        self.discovery_list = []
-        self.residue = ''
-        self.force_update = False
+        self.discovery_list = set()
+        
+        for waiters in self.ack_waiters.values():
+            for value, future in waiters.values():
+                future.cancel()
+        self.ack_waiters = {}
@@ -109,7 +109,7 @@ class EW11Client:
                     msg = MSG()
                     msg.topic = EW11_TOPIC + '/recv'
                     msg.payload = data   
-                    msg_queue.put(msg)
+                    msg_queue.put_nowait(msg)
                     self.update_receive_time()
                 
             except Exception as e:
@@ -0,0 +1,47 @@
+class FrameBuffer:
+    """EW11 수신 데이터 누적 버퍼 (처리 후 남은 짜투리 패킷 보관)"""
+
+    def __init__(self, capacity):
+        # 버퍼 최대 크기 (노이즈가 계속 들어와도 이 크기 이상 커지지 않음)
+        self.capacity = capacity
+        self.buffer = bytearray()
+
+    def __len__(self):
+        return len(self.buffer)
+
+    def append(self, data):
+        """수신 데이터를 버퍼 뒤에 추가하고, 용량 초과 시 버린 byte 수를 반환"""
+        self.buffer += data
+
+        overflow = len(self.buffer) - self.capacity
+        if overflow <= 0:
+            return 0
+
+        # 초과분 이후의 첫 F7부터 남겨 프레임 경계를 유지
+        start = self.buffer.find(0xF7, overflow)
+        if start < 0:
+            start = len(self.buffer)
+
+        del self.buffer[:start]
+        return start
+
+    def find(self, value, start=0):
+        """start 위치부터 value byte의 위치 검색 (없으면 -1)"""
+        return self.buffer.find(value, start)
+
+    def hex(self):
+        """버퍼 내용을 hex 문자열로 반환 (로그용)"""
+        return self.buffer.hex().upper()
+
+    def view(self):
+        """버퍼를 복사 없이 참조하는 memoryview 반환 (사용 후 release 필요)"""
+        return memoryview(self.buffer)
+
+    def consume(self, size):
+        """처리가 끝난 앞부분 size byte 제거"""
+        # bytearray 앞부분 삭제는 내부 시작 위치만 옮기므로 남은 데이터를 복사하지 않음
+        del self.buffer[:size]
+
+    def clear(self):
+        """버퍼 초기화"""
+        self.buffer = bytearray()
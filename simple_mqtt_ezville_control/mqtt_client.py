@@ -1,30 +1,60 @@
 import asyncio
 import json
-from queue import Queue
+import time
 
 import paho.mqtt.client as mqtt
 
-from constants import HA_TOPIC, EW11_TOPIC, STATE_TOPIC, DISCOVERY_DEVICE
+from constants import (HA_TOPIC, EW11_TOPIC, DISCOVERY_DEVICE, DISCOVERY_TOPIC, DISCOVERY_SUBSCRIBE_TOPIC,
+                       PUBLISH_BATCH_DELAY, PUBLISH_POLICY, ENCODED_PAYLOAD, WARM_START_IDLE, MQTT_MISC_INTERVAL)
 from utils import log
 
 
+def discovery_message(payload):
+    """Discovery Payload로 (config topic, 등록 메시지) 생성"""
+    message = {key: value for key, value in payload.items() if key != '_intg'}
+    
+    # MQTT 통합구성요소에 등록되기 위한 추가 내용
+    message['device'] = DISCOVERY_DEVICE
+    message['uniq_id'] = message['name']
+    
+    return DISCOVERY_TOPIC.format(payload['_intg'], message['name']), message
+
+
 class MQTTClientManager:
     """MQTT 통신 관리 클래스"""
     
     def __init__(self, config, device_manager):
         self.config = config
         self.device_manager = device_manager
-        self.msg_queue = Queue()
+        self.msg_queue = asyncio.Queue()
+        self.loop = None
         self.mqtt_online = False
         self.startup_delay = 0
         self.client = None
         
+        # State Publish 대기 목록 (topic -> payload, 같은 topic은 마지막 값만 Publish)
+        self.pending_states = {}
+        self.flush_handle = None
+        
+        # Publish 제한 정책이 있는 State의 마지막 Publish 시각, 보류 중인 값 (State Key -> (topic, 값, 정책)) 및 Timer
+        self.published_at = {}
+        self.held_states = {}
+        self.hold_handles = {}
+        
         # 로그 플래그
         self.mqtt_log = config['MQTT_LOG']
         self.reboot_control = config['reboot_control']
         self.reboot_delay = config['reboot_delay']
         self.comm_mode = config['mode']
         
+        # thread: paho 수신 thread 사용, asyncio: asyncio loop에서 socket 직접 처리
+        # (EW11 socket 통신은 blocking이므로 socket/mixed mode에서 asyncio를 쓰면 EW11 응답이 없을 때 MQTT까지 멈춤)
+        self.loop_mode = config['mqtt_loop_mode']
+        if self.loop_mode == 'asyncio' and self.comm_mode != 'mqtt':
+            log('[WARNING] mqtt_loop_mode asyncio는 mode가 mqtt일 때만 사용할 수 있습니다. thread로 실행합니다')
+            self.loop_mode = 'thread'
+        self.misc_task = None
+        
     def _on_connect(self, client, userdata, flags, reason_code, properties):
         """MQTT 통신 연결 Callback"""
         if reason_code == 0:
@@ -62,72 +92,278 @@ class MQTTClientManager:
                 elif status == 'offline':
                     log('[INFO] MQTT Integration 오프라인')
                     self.mqtt_online = False
-        # 나머지 topic은 모두 Queue에 보관
+        # asyncio mode는 이미 asyncio loop에서 실행 중이므로 바로 Queue에 보관
+        elif self.loop_mode == 'asyncio':
+            self.put_message(msg)
+        # 나머지 topic은 asyncio loop로 넘겨 Queue에 보관 (대기 중인 loop가 바로 처리)
         else:
-            self.msg_queue.put(msg)
+            self.loop.call_soon_threadsafe(self.put_message, msg)
  
     def _on_disconnect(self, client, userdata, flags, reason_code, properties):
         """MQTT 통신 연결 해제 Callback"""
         log('INFO: MQTT 연결 해제')
+    
+    def _on_socket_open(self, client, userdata, sock):
+        """asyncio mode: 수신 데이터가 있으면 loop_read 실행"""
+        self.loop.add_reader(sock, client.loop_read)
+    
+    def _on_socket_close(self, client, userdata, sock):
+        """asyncio mode: 닫힌 socket 감시 해제"""
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+    
+    def _on_socket_register_write(self, client, userdata, sock):
+        """asyncio mode: 보낼 데이터가 있으면 socket이 쓰기 가능할 때 loop_write 실행"""
+        self.loop.add_writer(sock, client.loop_write)
+    
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        """asyncio mode: 보낼 데이터를 모두 보내면 쓰기 감시 해제"""
+        self.loop.remove_writer(sock)
+    
+    async def _misc_loop(self):
+        """asyncio mode: paho keepalive 처리 및 연결이 끊기면 재연결"""
+        while True:
+            if self.client.loop_misc() == mqtt.MQTT_ERR_NO_CONN:
+                try:
+                    self.client.reconnect()
+                except OSError as e:
+                    log('[ERROR] MQTT Broker 연결 실패: {}'.format(e))
+            
+            await asyncio.sleep(MQTT_MISC_INTERVAL)
         
-    def connect(self):
-        """MQTT 클라이언트 연결"""
-        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, 'mqtt-ezville')
+    def connect(self, client_id='mqtt-ezville'):
+        """MQTT 클라이언트 연결 (같은 client_id로 연결된 기존 클라이언트는 Broker가 연결을 끊음)"""
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id)
         self.client.username_pw_set(self.config['mqtt_id'], self.config['mqtt_password'])
         self.client.on_connect = self._on_connect
         self.client.on_disconnect = self._on_disconnect
         self.client.on_message = self._on_message
+        if self.loop_mode == 'asyncio':
+            self.client.on_socket_open = self._on_socket_open
+            self.client.on_socket_close = self._on_socket_close
+            self.client.on_socket_register_write = self._on_socket_register_write
+            self.client.on_socket_unregister_write = self._on_socket_unregister_write
         self.client.connect_async(self.config['mqtt_server'])
         
     def start(self):
         """MQTT 루프 시작"""
+        # MQTT 수신 thread에서 메시지를 넘겨줄 asyncio loop
+        self.loop = asyncio.get_event_loop()
         if self.client:
-            self.client.loop_start()
+            # asyncio mode는 loop가 실행될 때 연결하며 재시작 시에도 연결 유지
+            if self.loop_mode == 'asyncio':
+                if self.misc_task is None:
+                    self.misc_task = self.loop.create_task(self._misc_loop())
+            else:
+                self.client.loop_start()
     
     def stop(self):
         """MQTT 루프 정지"""
-        if self.client:
+        self.flush()
+        if self.client and self.loop_mode != 'asyncio':
             self.client.loop_stop()
     
-    def publish(self, topic, payload):
+    def publish(self, topic, payload, retain=False):
         """메시지 발행"""
         if self.client:
-            self.client.publish(topic, payload)
+            self.client.publish(topic, payload, retain=retain)
+    
+    def put_message(self, msg):
+        """메시지 큐에 보관 (asyncio loop에서 호출)"""
+        self.msg_queue.put_nowait(msg)
     
     def get_message(self):
-        """메시지 큐에서 가져오기"""
+        """메시지 큐에서 가져오기 (없으면 None)"""
         if not self.msg_queue.empty():
-            return self.msg_queue.get()
+            return self.msg_queue.get_nowait()
         return None
     
-    def has_messages(self):
-        """메시지 큐에 메시지가 있는지 확인"""
-        return not self.msg_queue.empty()
+    async def wait_message(self, timeout=None):
+        """메시지가 도착할 때까지 대기 후 가져오기 (timeout 초과 시 None)"""
+        if timeout is None:
+            return await self.msg_queue.get()
+        try:
+            return await asyncio.wait_for(self.msg_queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
     
     async def mqtt_discovery(self, payload):
         """MQTT Discovery로 장치 자동 등록"""
-        intg = payload.pop('_intg')
-
-        # MQTT 통합구성요소에 등록되기 위한 추가 내용
-        payload['device'] = DISCOVERY_DEVICE
-        payload['uniq_id'] = payload['name']
-
-        # Discovery에 등록
-        topic = 'homeassistant/{}/ezville_wallpad/{}/config'.format(intg, payload['name'])
+        topic, message = discovery_message(payload)
         log('[INFO] 장치 등록:  {}'.format(topic))
-        self.publish(topic, json.dumps(payload))
+        
+        # 재시작 시 다시 등록하지 않으므로 Broker에 Retain으로 보관
+        self.publish(topic, json.dumps(message), retain=True)
     
-    async def update_state(self, device, state, id1, id2, value):
-        """장치 State를 MQTT로 Publish"""
-        deviceID = '{}_{:0>2d}_{:0>2d}'.format(device, id1, id2)
-        key = deviceID + state
+    async def collect_retained(self, timeout):
+        """Broker에 Retain된 State/Discovery 메시지 수집
+        
+        (State Key -> 값, Discovery topic -> 등록 메시지) 반환, 연결되지 않으면 None 반환
+        수집 중 받은 다른 메시지는 순서대로 다시 Queue에 보관
+        """
+        deadline = time.time() + timeout
         
-        if value != self.device_manager.get_state(key) or self.device_manager.force_update:
-            self.device_manager.set_state(key, value)
+        while not (self.client and self.client.is_connected()):
+            if time.time() > deadline:
+                return None
+            await asyncio.sleep(0.01)
+        
+        # HA_TOPIC은 연결 시 이미 구독하므로 Discovery topic만 추가 구독
+        self.client.subscribe(DISCOVERY_SUBSCRIBE_TOPIC)
+        
+        states = {}
+        configs = {}
+        deferred = []
+        last_received = time.time()
+        
+        while True:
+            timestamp = time.time()
+            msg = await self.wait_message(min(deadline - timestamp, last_received + WARM_START_IDLE - timestamp))
+            if msg is None:
+                break
             
-            topic = STATE_TOPIC.format(deviceID, state)
-            self.publish(topic, value.encode())
+            topics = msg.topic.split('/')
+            if msg.retain and topics[0] == HA_TOPIC and topics[-1] == 'state' and len(topics) == 4:
+                states[topics[1] + topics[2]] = msg.payload.decode('utf-8')
+                last_received = time.time()
+            elif msg.retain and topics[0] == 'homeassistant' and topics[-1] == 'config':
+                try:
+                    configs[msg.topic] = json.loads(msg.payload)
+                except ValueError:
+                    pass
+                last_received = time.time()
+            else:
+                deferred.append(msg)
+        
+        self.client.unsubscribe(DISCOVERY_SUBSCRIBE_TOPIC)
+        
+        # 수집 중 받은 다른 메시지는 이후 메시지보다 먼저 처리되도록 다시 보관
+        while True:
+            msg = self.get_message()
+            if msg is None:
+                break
+            deferred.append(msg)
+        for msg in deferred:
+            self.put_message(msg)
+        
+        return states, configs
+    
+    async def update_states(self, changes):
+        """여러 장치 State를 한번에 MQTT로 Publish"""
+        for entity, state, value in changes:
+            self._publish_state(entity, state, value)
+    
+    def _publish_state(self, entity, state, value):
+        """변경된 State만 Publish 대기 목록에 추가"""
+        key, topic = entity.state(state)
+        
+        if value == self.device_manager.get_state(key):
+            # 보류 중인 값이 있었다면 이미 Publish된 값으로 돌아왔으므로 취소
+            if key in self.held_states:
+                self._cancel_hold(key)
+            return
+        
+        policy = PUBLISH_POLICY.get(entity.device, {}).get(state)
+        if policy is not None:
+            delay = self._policy_delay(key, value, policy)
+            if delay > 0:
+                self._hold_state(key, topic, value, policy, delay)
+                return
+            
+            self._cancel_hold(key)
+            self.published_at[key] = time.time()
+        
+        self.device_manager.set_state(key, value)
+        self._queue_publish(topic, value)
+    
+    def _policy_delay(self, key, value, policy):
+        """Publish 제한 정책에 따라 value를 Publish할 수 있을 때까지 남은 시간(초) 계산 (0이면 바로 Publish)"""
+        last_value = self.device_manager.get_state(key)
+        if last_value is None:
+            return 0
+        
+        elapsed = time.time() - self.published_at.get(key, 0)
+        delay = policy['min_interval'] - elapsed
+        
+        # 변화량이 Deadband 이내이면 max_staleness가 지난 후에만 Publish
+        try:
+            last_number = float(last_value)
+            change = abs(float(value) - last_number)
+        except ValueError:
+            return max(delay, 0)
+        
+        if change < max(policy['deadband'], policy['relative_deadband'] * abs(last_number)):
+            delay = max(delay, policy['max_staleness'] - elapsed)
+        
+        return max(delay, 0)
+    
+    def _hold_state(self, key, topic, value, policy, delay):
+        """Publish하지 않은 값을 보관하고 delay초 후 다시 확인"""
+        self.held_states[key] = (topic, value, policy)
+        
+        handle = self.hold_handles.get(key)
+        if handle is not None:
+            handle.cancel()
+        self.hold_handles[key] = asyncio.get_running_loop().call_later(delay, self._release_state, key)
+    
+    def _release_state(self, key):
+        """보류 중인 값을 정책에 따라 Publish"""
+        self.hold_handles.pop(key, None)
+        held = self.held_states.pop(key, None)
+        if held is None:
+            return
+        
+        topic, value, policy = held
+        delay = self._policy_delay(key, value, policy)
+        if delay > 0:
+            self._hold_state(key, topic, value, policy, delay)
+            return
+        
+        self.published_at[key] = time.time()
+        self.device_manager.set_state(key, value)
+        self._queue_publish(topic, value)
+    
+    def _cancel_hold(self, key):
+        """보류 중인 값 및 Timer 취소"""
+        self.held_states.pop(key, None)
+        handle = self.hold_handles.pop(key, None)
+        if handle is not None:
+            handle.cancel()
+    
+    def reset(self):
+        """Publish 제한 정책 관련 정보 초기화"""
+        for handle in self.hold_handles.values():
+            handle.cancel()
+        self.published_at = {}
+        self.held_states = {}
+        self.hold_handles = {}
+    
+    def refresh_state(self, entity):
+        """장치의 현재 State를 변경 여부와 관계없이 다시 Publish"""
+        for key, topic in entity.states.values():
+            value = self.device_manager.get_state(key)
+            if value is not None:
+                self._queue_publish(topic, value)
+    
+    def _queue_publish(self, topic, value):
+        """State를 Publish 대기 목록에 추가"""
+        self.pending_states[topic] = value
+        
+        # PUBLISH_BATCH_DELAY초 동안 모인 State를 한번에 Publish
+        if self.flush_handle is None:
+            self.flush_handle = asyncio.get_running_loop().call_later(PUBLISH_BATCH_DELAY, self.flush)
+    
+    def flush(self):
+        """Publish 대기 중인 State를 모두 Publish"""
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        
+        pending_states, self.pending_states = self.pending_states, {}
+        
+        # 재시작 시 Warm start에 사용하도록 Retain으로 Publish
+        for topic, value in pending_states.items():
+            self.publish(topic, ENCODED_PAYLOAD.get(value) or value.encode(), retain=True)
                     
             if self.mqtt_log:
                 log('[LOG] ->> HA : {} >> {}'.format(topic, value))
-        return
@@ -1,7 +1,39 @@
 import asyncio
+import hashlib
+import json
+import time
 
-from constants import STATE_HEADER, ACK_HEADER, DISCOVERY_PAYLOAD
-from utils import log, checksum
+from constants import (RS485_DEVICE, DISCOVERY_DEVICE, DISCOVERY_PAYLOAD, FRAME_BUFFER_SIZE,
+                       BUS_GAP_VARIANCE, BUS_GAP_NOISE, BUS_GAP_DRIFT, BUS_GAP_MAX, BUS_GAP_SAMPLES)
+from bus_timing import BusTiming
+from frame_buffer import FrameBuffer
+from mqtt_client import discovery_message
+from utils import log, verify_checksum
+
+
+# 유효한 device ID 목록 (노이즈 필터링용)
+VALID_DEVICE_IDS = frozenset(
+    int(code['id'], 16)
+    for prop in RS485_DEVICE.values()
+        for code in prop.values()
+)
+
+
+def build_decoder_table(decoders):
+    """RS485_DEVICE 정보로 (Device ID, CMD) -> (처리 함수, STATE 패킷 여부) Dictionary 생성"""
+    table = {}
+    for device, prop in RS485_DEVICE.items():
+        handler = decoders.get(device)
+        if handler is None:
+            continue
+        
+        for cmd, code in prop.items():
+            device_id = int(code['id'], 16)
+            if cmd == 'state':
+                table[(device_id, int(code['cmd'], 16))] = (handler, True)
+            elif 'ack' in code:
+                table[(device_id, int(code['ack'], 16))] = (handler, False)
+    return table
 
 
 class PacketProcessor:
@@ -16,155 +48,244 @@ class PacketProcessor:
         self.ew11_log = config['EW11_LOG']
         self.discovery_delay = config['discovery_delay']
         
+        # EW11 전달 패킷 중 처리 후 남은 짜투리 패킷 저장
+        self.frame_buffer = FrameBuffer(FRAME_BUFFER_SIZE)
+        
+        # 패킷 수신 시각 기반 bus 유휴 시간 통계 (명령 전송 시점 결정용)
+        self.bus_timing = BusTiming(BUS_GAP_VARIANCE, BUS_GAP_NOISE, BUS_GAP_DRIFT, BUS_GAP_MAX, BUS_GAP_SAMPLES)
+        
+        # Discovery 요청 Queue 및 Discovery 전까지 보관하는 장치별 State
+        self.discovery_queue = asyncio.Queue()
+        self.pending_discovery = {}
+        
+        # 분리된 유효 패킷 누적 수 및 동기화 과정에서 버린 byte 누적 수
+        self.frame_count = 0
+        self.discarded_bytes = 0
+        
+        # 장치별 패킷 처리 함수 등록 (새 장치는 RS485_DEVICE와 여기에만 추가)
+        self.decoders = build_decoder_table({
+            'light': self._decode_light_packet,
+            'thermostat': self._decode_thermostat_packet,
+            'plug': self._decode_plug_packet,
+            'gasvalve': self._decode_gasvalve_packet,
+            'batch': self._decode_batch_packet,
+        })
+        
     async def process_packet(self, raw_data):
-        """EW11 전달된 메시지 처리"""
-        raw_data = self.device_manager.get_residue() + raw_data
+        """EW11 전달된 메시지 처리 후 버린 byte 수 반환"""
+        frames, discarded = self.split_frames(raw_data)
+        
+        if frames:
+            await self.dispatch_frames(frames)
+        
+        return discarded
+    
+    def split_frames(self, raw_data):
+        """수신 데이터를 유효한 패킷 목록으로 분리 (남은 짜투리 패킷은 버퍼에 보관)
+        
+        (처리 함수, 패킷, STATE 패킷 여부) 목록과 버린 byte 수를 반환
+        """
+        dropped = self.frame_buffer.append(raw_data)
         
         if self.ew11_log:
-            log('[SIGNAL] receved: {}'.format(raw_data))
+            if dropped:
+                log('[WARNING] Frame buffer overflow, {} bytes dropped'.format(dropped))
+            log('[SIGNAL] receved: {}'.format(self.frame_buffer.hex()))
+        
+        buffer = self.frame_buffer
+        frames = []
         
-        # 유효한 device ID 목록
-        VALID_DEVICE_IDS = {'0E', '35', '50', '12', '33'}
+        # 처리 완료된 byte 수 (나머지는 RESIDUE로 버퍼에 남김)
+        consumed = total = len(buffer)
+        # 정상 패킷으로 처리된 byte 수
+        framed = 0
         
-        k = 0
-        msg_length = len(raw_data)
+        # chunk 안에서 끝난 패킷 종류 및 마지막 패킷의 끝 위치 (유휴 시간 추정용)
+        headers = []
+        last_end = 0
         
-        while k < msg_length:
+        with self.frame_buffer.view() as view:
+            k = buffer.find(0xF7)
+            
             # F7로 시작하는 패턴을 패킷으로 분리
-            if raw_data[k:k + 2] == 'F7':
-                # 최소 4바이트(F7 + Device ID) 확인
-                if k + 4 > msg_length:
-                    self.device_manager.set_residue(raw_data[k:])
+            while k >= 0:
+                packet_length = match_frame(view, k)
+                
+                # 남은 데이터가 패킷 길이를 만족하지 못하면 RESIDUE로 남기고 종료
+                if packet_length == 0:
+                    consumed = k
                     break
                 
-                # Device ID 확인 (노이즈 필터링)
-                device_id = raw_data[k + 2:k + 4]
-                if device_id not in VALID_DEVICE_IDS:
-                    # 노이즈 패킷 - 1바이트씩 진행
-                    if self.ew11_log:
-                        log('[WARNING] Invalid device ID detected: {}, skipping noise'.format(device_id))
-                    k += 1
+                # 노이즈 또는 Checksum 오류 - 다음 F7 위치로 바로 이동
+                if packet_length < 0:
+                    k = buffer.find(0xF7, k + 1)
                     continue
                 
-                # 남은 데이터가 최소 패킷 길이를 만족하지 못하면 RESIDUE에 저장 후 종료
-                if k + 10 > msg_length:
-                    self.device_manager.set_residue(raw_data[k:])
-                    break
-                else:
-                    try:
-                        data_length = int(raw_data[k + 8:k + 10], 16)
-                        packet_length = 10 + data_length * 2 + 4
-                    except ValueError:
-                        # 데이터 길이 파싱 실패 - 노이즈로 판단
-                        if self.ew11_log:
-                            log('[WARNING] Invalid data length at position {}, skipping'.format(k))
-                        k += 1
-                        continue
-                    
-                    # 남은 데이터가 예상되는 패킷 길이보다 짧으면 RESIDUE에 저장 후 종료
-                    if k + packet_length > msg_length:
-                        self.device_manager.set_residue(raw_data[k:])
-                        break
-                    else:
-                        packet = raw_data[k:k + packet_length]
-                        
-                # 분리된 패킷이 Valid한 패킷인지 Checksum 확인                
-                if packet != checksum(packet):
-                    k += 1
+                framed += packet_length
+                self.frame_count += 1
+                last_end = k + packet_length
+                header = (view[k + 1], view[k + 3])
+                headers.append(header)
+                
+                # (Device ID, CMD)로 STATE/ACK 패킷 및 처리 함수 확인
+                decoder = self.decoders.get(header)
+                if decoder is None:
+                    k = buffer.find(0xF7, k + packet_length)
                     continue
-                else:
-                    await self._process_valid_packet(packet)
+                
+                handler, is_state_packet = decoder
+                
+                # 직전에 받은 같은 Header의 STATE 패킷과 동일하면 처리하지 않음
+                if is_state_packet:
+                    packet_key = bytes(view[k:k + 5])
+                    if self.device_manager.is_cached(packet_key, view[k + 5:k + packet_length]):
+                        k = buffer.find(0xF7, k + packet_length)
+                        continue
                     
-                self.device_manager.clear_residue()
-                k = k + packet_length
-            else:
-                k += 1
-    
-    async def _process_valid_packet(self, packet):
-        """유효한 패킷 처리"""
-        STATE_PACKET = False
-        ACK_PACKET = False
-        
-        # STATE 패킷인지 확인
-        if packet[2:4] in STATE_HEADER and packet[6:8] in STATE_HEADER[packet[2:4]][1]:
-            STATE_PACKET = True
-        # ACK 패킷인지 확인
-        elif packet[2:4] in ACK_HEADER and packet[6:8] in ACK_HEADER[packet[2:4]][1]:
-            ACK_PACKET = True
-        
-        if STATE_PACKET or ACK_PACKET:
-            # MSG_CACHE에 없는 새로운 패킷이거나 FORCE_UPDATE 실행된 경우만 실행
-            if not self.device_manager.is_cached(packet[0:10], packet[10:]) or self.device_manager.force_update:
-                name = STATE_HEADER[packet[2:4]][0]
+                    self.device_manager.cache_packet(packet_key, bytes(view[k + 5:k + packet_length]))
                 
-                if name == 'light':
-                    await self._process_light_packet(packet, STATE_PACKET)
-                elif name == 'thermostat':
-                    await self._process_thermostat_packet(packet, STATE_PACKET)
-                elif name == 'plug':
-                    await self._process_plug_packet(packet, STATE_PACKET)
-                elif name == 'gasvalve':
-                    await self._process_gasvalve_packet(packet, STATE_PACKET)
-                elif name == 'batch':
-                    await self._process_batch_packet(packet, STATE_PACKET)
-    
-    async def _process_light_packet(self, packet, is_state_packet):
-        """조명 패킷 처리"""
-        name = 'light'
-        # ROOM ID
-        rid = int(packet[5], 16)
-        # ROOM의 light 갯수 + 1
-        slc = int(packet[8:10], 16) 
+                frames.append((handler, bytes(view[k:k + packet_length]), is_state_packet))
+                k = buffer.find(0xF7, k + packet_length)
         
-        for id in range(1, slc):
-            discovery_name = '{}_{:0>2d}_{:0>2d}'.format(name, rid, id)
+            # chunk 끝에서 전송 중인 패킷 (Header까지 수신된 경우 종류 및 남은 byte 수)
+            tail = None
+            if consumed < total - 4:
+                tail = ((view[consumed + 1], view[consumed + 3]), view[consumed + 4] + 7 - (total - consumed))
+        
+        # chunk 마지막 byte로 끝난 패킷은 뒤의 유휴 시간이 다음 chunk 구간에 포함됨
+        last_header = headers.pop() if headers and last_end == total else None
+        self.bus_timing.observe(time.monotonic(), len(raw_data), headers, last_header, tail)
+        
+        self.frame_buffer.consume(consumed)
+        
+        # 패킷에 포함되지 않고 버려진 byte 수 (노이즈 + 용량 초과)
+        discarded = consumed - framed + dropped
+        self.discarded_bytes += discarded
+        
+        if self.ew11_log and discarded:
+            log('[WARNING] Resync: {} bytes discarded'.format(discarded))
+        
+        return frames, discarded
+    
+    async def dispatch_frames(self, frames):
+        """분리된 패킷 목록을 해석하여 State 변경을 한번에 Publish"""
+        changes = []
+        for handler, packet, is_state_packet in frames:
+            frame_changes = handler(packet, is_state_packet)
             
-            if not self.device_manager.is_discovered(discovery_name):
-                self.device_manager.add_discovery(discovery_name)
+            # 확인 대기 중인 명령이 있으면 ACK/STATE 패킷 해석 즉시 완료 처리
+            if self.device_manager.ack_waiters:
+                self.device_manager.resolve_states(packet[1], frame_changes)
             
-                payload = DISCOVERY_PAYLOAD[name][0].copy()
-                payload['~'] = payload['~'].format(rid, id)
-                payload['name'] = payload['name'].format(rid, id)
-           
+            for change in frame_changes:
+                entity, state, value = change
+                
+                if self.device_manager.is_discovered(entity.name):
+                    changes.append(change)
+                    continue
+                
+                # Discovery 전인 장치는 State를 보관하고 Discovery 요청 (같은 State는 마지막 값만 유지)
+                if entity.name not in self.pending_discovery:
+                    payloads = self._discovery_payloads(entity)
+                    
+                    self.pending_discovery[entity.name] = {}
+                    self.discovery_queue.put_nowait((entity.name, payloads, payload_digest(payloads)))
+                self.pending_discovery[entity.name][state] = change
+        
+        if changes:
+            await self.mqtt_client.update_states(changes)
+    
+    async def discovery_loop(self):
+        """Discovery 요청된 장치를 순서대로 등록 후 보관 중인 State Publish"""
+        while True:
+            discovery_name, payloads, payload_hash = await self.discovery_queue.get()
+            
+            for payload in payloads:
                 # 장치 등록 후 DISCOVERY_DELAY초 후에 State 업데이트
                 await self.mqtt_client.mqtt_discovery(payload)
                 await asyncio.sleep(self.discovery_delay)
             
-            # State 업데이트까지 진행
-            onoff = 'ON' if int(packet[10 + 2 * id: 12 + 2 * id], 16) > 0 else 'OFF'
-                
-            await self.mqtt_client.update_state(name, 'power', rid, id, onoff)
+            self.device_manager.add_discovery(discovery_name, payload_hash)
+            
+            changes = self.pending_discovery.pop(discovery_name, {})
+            await self.mqtt_client.update_states(changes.values())
+            
+            self.discovery_queue.task_done()
+    
+    def reset(self):
+        """수신 버퍼 및 Discovery 대기 목록 초기화"""
+        self.frame_buffer.clear()
+        self.discovery_queue = asyncio.Queue()
+        self.pending_discovery = {}
+    
+    def restore_discovery(self, configs):
+        """Broker에 Retain된 Discovery 메시지로 장치 등록 정보 복원 후 복원된 장치 수 반환
+        
+        모든 등록 메시지가 현재 Payload와 같은 장치는 등록된 것으로 처리하고,
+        등록 정보에는 있지만 Broker에 없거나 내용이 다른 장치는 다시 등록하도록 제거
+        """
+        names = set()
+        for message in configs.values():
+            if isinstance(message, dict) and isinstance(message.get('~'), str):
+                names.add(message['~'].split('/')[-1])
+        
+        restored = {}
+        for name in names:
+            device, _, ids = name.partition('_')
+            rid, _, idx = ids.partition('_')
+            if device not in DISCOVERY_PAYLOAD or not rid.isdigit() or not idx.isdigit():
+                continue
+            
+            entity = self.device_manager.get_entity(device, int(rid), int(idx))
+            payloads = self._discovery_payloads(entity)
             
-            # 직전 처리 State 패킷은 저장
-            if is_state_packet:
-                self.device_manager.cache_packet(packet[0:10], packet[10:])
+            if all(configs.get(topic) == message for topic, message in map(discovery_message, payloads)):
+                restored[entity.name] = payload_digest(payloads)
+        
+        self.device_manager.set_registry(restored)
+        return len(restored)
     
-    async def _process_thermostat_packet(self, packet, is_state_packet):
-        """온도조절기 패킷 처리"""
+    def _discovery_payloads(self, entity):
+        """장치의 Discovery Payload 목록 생성"""
+        payloads = []
+        for payload_template in DISCOVERY_PAYLOAD[entity.device]:
+            payload = payload_template.copy()
+            payload['~'] = payload['~'].format(entity.rid, entity.idx)
+            payload['name'] = payload['name'].format(entity.rid, entity.idx)
+            payloads.append(payload)
+        return payloads
+    
+    def _decode_light_packet(self, packet, is_state_packet):
+        """조명 패킷 해석"""
+        name = 'light'
+        # ROOM ID
+        rid = packet[2] & 0x0F
+        # ROOM의 light 갯수 + 1
+        slc = packet[4]
+        
+        changes = []
+        for id in range(1, slc):
+            onoff = 'ON' if packet[5 + id] > 0 else 'OFF'
+            changes.append((self.device_manager.get_entity(name, rid, id), 'power', onoff))
+        return changes
+    
+    def _decode_thermostat_packet(self, packet, is_state_packet):
+        """온도조절기 패킷 해석"""
         name = 'thermostat'
         # Room ID (3번째 바이트의 하위 니블)
-        rid = int(packet[4:6], 16) & 0x0F
+        rid = packet[2] & 0x0F
         src = 1
         
-        discovery_name = '{}_{:0>2d}_{:0>2d}'.format(name, rid, src)
-        
-        if not self.device_manager.is_discovered(discovery_name):
-            self.device_manager.add_discovery(discovery_name)
-        
-            payload = DISCOVERY_PAYLOAD[name][0].copy()
-            payload['~'] = payload['~'].format(rid, src)
-            payload['name'] = payload['name'].format(rid, src)
-       
-            # 장치 등록 후 DISCOVERY_DELAY초 후에 State 업데이트
-            await self.mqtt_client.mqtt_discovery(payload)
-            await asyncio.sleep(self.discovery_delay)
+        # 데이터 길이가 부족하면 노이즈로 판단
+        if packet[4] < 5:
+            return []
         
         # 데이터 파싱
-        # Byte 1 (Index 12:14): 상태 (01: Heat, 02: Off/Away?)
-        # Byte 2 (Index 14:16): 설정 온도
-        # Byte 4 (Index 18:20): 현재 온도
+        # Byte 6: 상태 (01: Heat, 02: Off/Away?)
+        # Byte 7: 설정 온도
+        # Byte 9: 현재 온도
         
-        state_byte = int(packet[12:14], 16)
+        state_byte = packet[6]
         
         # 상태 판단 (로그 분석 기반 임시 로직)
         # 01: Heat
@@ -176,143 +297,144 @@ class PacketProcessor:
 
         # 온도는 BCD 코드로 추정됨 (Hex 문자열을 그대로 10진수로 인식)
         # 예: 0x23 -> 35(X), 23(O)
-        try:
-            setT = str(int(packet[14:16]))
-            curT = str(int(packet[18:20]))
-        except ValueError:
+        if _is_bcd(packet[7]) and _is_bcd(packet[9]):
+            setT = '{:x}'.format(packet[7])
+            curT = '{:x}'.format(packet[9])
+        else:
             # BCD가 아닌 경우(A-F 포함)에 대한 예외 처리 (기존 방식 유지)
-            setT = str(int(packet[14:16], 16))
-            curT = str(int(packet[18:20], 16))
+            setT = str(packet[7])
+            curT = str(packet[9])
 
-        await self.mqtt_client.update_state(name, 'power', rid, src, onoff)
-        await self.mqtt_client.update_state(name, 'curTemp', rid, src, curT)
-        await self.mqtt_client.update_state(name, 'setTemp', rid, src, setT)
-        
-        # 직전 처리 State 패킷은 저장
-        if is_state_packet:
-            self.device_manager.cache_packet(packet[0:10], packet[10:])
-        else:
-            # Ack 패킷도 해당 방의 State 패킷으로 간주하여 저장 (중복 처리 방지)
-            # Header(F7) + ID(35) + RID + CMD(81) + Len
-            state_header = packet[0:6] + '81' + packet[8:10]
-            self.device_manager.cache_packet(state_header, packet[10:])
+        entity = self.device_manager.get_entity(name, rid, src)
+        return [
+            (entity, 'power', onoff),
+            (entity, 'curTemp', curT),
+            (entity, 'setTemp', setT),
+        ]
     
-    async def _process_plug_packet(self, packet, is_state_packet):
-        """플러그 패킷 처리"""
+    def _decode_plug_packet(self, packet, is_state_packet):
+        """플러그 패킷 해석"""
         name = 'plug'
         
         # plug는 ACK PACKET에 상태 정보가 없으므로 STATE_PACKET만 처리
         if not is_state_packet:
-            return
+            return []
         
         # ROOM ID
-        rid = int(packet[5], 16)
+        rid = packet[2] & 0x0F
         # ROOM의 plug 갯수
-        spc = int(packet[10:12], 16) 
-    
-        for id in range(1, spc + 1):
-            discovery_name = '{}_{:0>2d}_{:0>2d}'.format(name, rid, id)
-
-            if not self.device_manager.is_discovered(discovery_name):
-                self.device_manager.add_discovery(discovery_name)
-        
-                for payload_template in DISCOVERY_PAYLOAD[name]:
-                    payload = payload_template.copy()
-                    payload['~'] = payload['~'].format(rid, id)
-                    payload['name'] = payload['name'].format(rid, id)
-           
-                    # 장치 등록 후 DISCOVERY_DELAY초 후에 State 업데이트
-                    await self.mqtt_client.mqtt_discovery(payload)
-                    await asyncio.sleep(self.discovery_delay)  
+        spc = packet[5]
         
+        # 데이터 길이가 plug 갯수와 맞지 않으면 노이즈로 판단
+        if packet[4] < 1 + 3 * spc:
+            return []
+        
+        changes = []
+        for id in range(1, spc + 1):
             # BIT0: 대기전력 On/Off, BIT1: 자동모드 On/Off
             # 위와 같지만 일단 on-off 여부만 판단
-            onoff = 'ON' if int(packet[7 + 6 * id], 16) > 0 else 'OFF'
-            autoonoff = 'ON' if int(packet[6 + 6 * id], 16) > 0 else 'OFF'
-            power_num = '{:.2f}'.format(int(packet[8 + 6 * id: 12 + 6 * id], 16) / 100)
+            onoff = 'ON' if packet[3 + 3 * id] & 0x0F > 0 else 'OFF'
+            autoonoff = 'ON' if packet[3 + 3 * id] >> 4 > 0 else 'OFF'
+            power_num = '{:.2f}'.format(int.from_bytes(packet[4 + 3 * id:6 + 3 * id], 'big') / 100)
             
-            await self.mqtt_client.update_state(name, 'power', rid, id, onoff)
-            await self.mqtt_client.update_state(name, 'auto', rid, id, onoff)
-            await self.mqtt_client.update_state(name, 'current', rid, id, power_num)
-        
-            # 직전 처리 State 패킷은 저장
-            self.device_manager.cache_packet(packet[0:10], packet[10:])
+            entity = self.device_manager.get_entity(name, rid, id)
+            changes.append((entity, 'power', onoff))
+            changes.append((entity, 'auto', onoff))
+            changes.append((entity, 'current', power_num))
+        return changes
     
-    async def _process_gasvalve_packet(self, packet, is_state_packet):
-        """가스밸브 패킷 처리"""
+    def _decode_gasvalve_packet(self, packet, is_state_packet):
+        """가스밸브 패킷 해석"""
         name = 'gasvalve'
         # Gas Value는 하나라서 강제 설정
         rid = 1
         # Gas Value는 하나라서 강제 설정
         spc = 1 
         
-        discovery_name = '{}_{:0>2d}_{:0>2d}'.format(name, rid, spc)
-            
-        if not self.device_manager.is_discovered(discovery_name):
-            self.device_manager.add_discovery(discovery_name)
-            
-            payload = DISCOVERY_PAYLOAD[name][0].copy()
-            payload['~'] = payload['~'].format(rid, spc)
-            payload['name'] = payload['name'].format(rid, spc)
-           
-            # 장치 등록 후 DISCOVERY_DELAY초 후에 State 업데이트
-            await self.mqtt_client.mqtt_discovery(payload)
-            await asyncio.sleep(self.discovery_delay)                                
-
-        onoff = 'ON' if int(packet[12:14], 16) == 1 else 'OFF'
-                
-        await self.mqtt_client.update_state(name, 'power', rid, spc, onoff)
+        # 데이터 길이가 부족하면 노이즈로 판단
+        if packet[4] < 2:
+            return []
+        
+        onoff = 'ON' if packet[6] == 1 else 'OFF'
         
-        # 직전 처리 State 패킷은 저장
-        if is_state_packet:
-            self.device_manager.cache_packet(packet[0:10], packet[10:])
+        return [(self.device_manager.get_entity(name, rid, spc), 'power', onoff)]
     
-    async def _process_batch_packet(self, packet, is_state_packet):
-        """일괄차단기 패킷 처리"""
+    def _decode_batch_packet(self, packet, is_state_packet):
+        """일괄차단기 패킷 해석"""
         name = 'batch'
         
         # 일괄차단기 ACK PACKET은 상태 업데이트에 반영하지 않음
         if not is_state_packet:
-            return
+            return []
         
         # 일괄차단기는 하나라서 강제 설정
         rid = 1
         # 일괄차단기는 하나라서 강제 설정
         sbc = 1
         
-        discovery_name = '{}_{:0>2d}_{:0>2d}'.format(name, rid, sbc)
+        # 데이터 길이가 부족하면 노이즈로 판단
+        if packet[4] < 2:
+            return []
         
-        if not self.device_manager.is_discovered(discovery_name):
-            self.device_manager.add_discovery(discovery_name)
-            
-            for payload_template in DISCOVERY_PAYLOAD[name]:
-                payload = payload_template.copy()
-                payload['~'] = payload['~'].format(rid, sbc)
-                payload['name'] = payload['name'].format(rid, sbc)
-           
-                # 장치 등록 후 DISCOVERY_DELAY초 후에 State 업데이트
-                await self.mqtt_client.mqtt_discovery(payload)
-                await asyncio.sleep(self.discovery_delay)           
-
         # 일괄 차단기는 버튼 상태 변수 업데이트
-        states = bin(int(packet[12:14], 16))[2:].zfill(8)
+        states = packet[6]
                 
-        ELEVDOWN = states[2]                                        
-        ELEVUP = states[3]
-        GROUPON = states[5]
-        OUTING = states[6]
+        ELEVDOWN = states & 0x20
+        ELEVUP = states & 0x10
+        GROUPON = states & 0x04
+        OUTING = states & 0x02
                                             
-        grouponoff = 'ON' if GROUPON == '1' else 'OFF'
-        outingonoff = 'ON' if OUTING == '1' else 'OFF'
+        grouponoff = 'ON' if GROUPON else 'OFF'
+        outingonoff = 'ON' if OUTING else 'OFF'
         
         #ELEVDOWN과 ELEVUP은 직접 DEVICE_STATE에 저장
-        elevdownonoff = 'ON' if ELEVDOWN == '1' else 'OFF'
-        elevuponoff = 'ON' if ELEVUP == '1' else 'OFF'
+        elevdownonoff = 'ON' if ELEVDOWN else 'OFF'
+        elevuponoff = 'ON' if ELEVUP else 'OFF'
         self.device_manager.set_state('batch_01_01elevator-up', elevuponoff)
         self.device_manager.set_state('batch_01_01elevator-down', elevdownonoff)
             
         # 일괄 조명 및 외출 모드는 상태 업데이트
-        await self.mqtt_client.update_state(name, 'group', rid, sbc, grouponoff)
-        await self.mqtt_client.update_state(name, 'outing', rid, sbc, outingonoff)
-        
-        self.device_manager.cache_packet(packet[0:10], packet[10:])
+        entity = self.device_manager.get_entity(name, rid, sbc)
+        return [
+            (entity, 'group', grouponoff),
+            (entity, 'outing', outingonoff),
+        ]
+
+
+def match_frame(view, k):
+    """k 위치의 F7에서 시작하는 패킷 길이 반환 (0: 데이터 부족, -1: 유효하지 않은 패킷)"""
+    msg_length = len(view)
+    
+    # 최소 2바이트(F7 + Device ID) 확인
+    if k + 2 > msg_length:
+        return 0
+    
+    # Device ID 확인 (노이즈 필터링)
+    if view[k + 1] not in VALID_DEVICE_IDS:
+        return -1
+    
+    # 길이 필드까지 수신되었는지 확인
+    if k + 5 > msg_length:
+        return 0
+    
+    # Header(5) + Data + XOR + ADD
+    packet_length = 5 + view[k + 4] + 2
+    if k + packet_length > msg_length:
+        return 0
+    
+    # 길이 필드가 가리키는 위치의 Checksum까지 맞아야 유효한 패킷
+    if not verify_checksum(view, k, k + packet_length):
+        return -1
+    
+    return packet_length
+
+
+def payload_digest(payloads):
+    """Discovery Payload 변경 여부 확인용 hash"""
+    content = json.dumps([payloads, DISCOVERY_DEVICE], sort_keys=True)
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def _is_bcd(value):
+    """1 BYTE 값이 BCD 형식인지 확인"""
+    return (value >> 4) < 10 and (value & 0x0F) < 10
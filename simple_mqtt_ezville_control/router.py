@@ -0,0 +1,50 @@
+from constants import HA_TOPIC, EW11_TOPIC, RS485_DEVICE
+
+
+class Route:
+    """MQTT topic별로 미리 분석해 둔 처리 정보"""
+
+    def __init__(self, topic, handler=None, device=None, room=None, index=None, attribute=None, name=None):
+        self.topic = topic
+        self.handler = handler
+
+        # HA 명령 topic (ezville/<device>_<room>_<index>/<attribute>/command)의 장치 정보
+        self.device = device
+        self.room = room
+        self.index = index
+        self.attribute = attribute
+        self.name = name
+        self.key = name + attribute if name is not None else None
+
+
+class TopicRouter:
+    """MQTT topic을 처리 함수와 장치 정보로 변환 (처음 확인된 topic만 분석 후 재사용)"""
+
+    def __init__(self, command_handler, recv_handler):
+        self.command_handler = command_handler
+        self.recv_handler = recv_handler
+        self.routes = {}
+
+    def resolve(self, topic):
+        """topic의 Route 조회"""
+        route = self.routes.get(topic)
+        if route is None:
+            route = self.routes[topic] = self._compile(topic)
+        return route
+
+    def _compile(self, topic):
+        """topic을 분석하여 Route 생성 (처리하지 않는 topic은 handler가 None)"""
+        topics = topic.split('/')
+
+        if topics[0] == HA_TOPIC and topics[-1] == 'command':
+            # 등록된 장치가 아니면 로그만 남기도록 장치 정보 없이 전달
+            device_info = topics[1].split('_') if len(topics) == 4 else []
+            if len(device_info) != 3 or device_info[0] not in RS485_DEVICE or not (device_info[1].isdigit() and device_info[2].isdigit()):
+                return Route(topic, self.command_handler)
+
+            return Route(topic, self.command_handler, device_info[0], int(device_info[1]), int(device_info[2]), topics[2], topics[1])
+
+        if topics[0] == EW11_TOPIC and topics[-1] == 'recv':
+            return Route(topic, self.recv_handler)
+
+        return Route(topic)
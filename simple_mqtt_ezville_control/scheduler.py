@@ -0,0 +1,104 @@
+import asyncio
+import heapq
+import itertools
+
+
+class CommandScheduler:
+    """우선순위 명령 Queue (우선순위 값이 작을수록 먼저, 같은 우선순위는 들어온 순서대로 처리)
+
+    처리할 수 없는 명령 (lane 사용 중)은 꺼내지 않고 남겨두므로 대기 중인 명령 전체에 우선순위가 적용됨
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()
+
+        # 명령을 기다리는 command_loop (Polling 없이 명령이 들어오면 바로 깨움)
+        self.waiter = None
+
+    def __len__(self):
+        return len(self.heap)
+
+    def empty(self):
+        """대기 중인 명령이 없는지 확인"""
+        return not self.heap
+
+    def put(self, priority, item):
+        """명령 추가"""
+        heapq.heappush(self.heap, (priority, next(self.counter), item))
+        self.wake()
+
+    def get_nowait(self, is_ready=None):
+        """우선순위가 가장 높은 명령 꺼내기 (is_ready가 있으면 조건을 만족하는 명령 중에서, 없으면 asyncio.QueueEmpty)"""
+        skipped = []
+        found = None
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            if is_ready is None or is_ready(entry[2]):
+                found = entry
+                break
+            skipped.append(entry)
+
+        for entry in skipped:
+            heapq.heappush(self.heap, entry)
+
+        if found is None:
+            raise asyncio.QueueEmpty
+        return found[2]
+
+    async def get(self, is_ready=None):
+        """조건을 만족하는 명령이 있을 때까지 대기 후 우선순위가 가장 높은 명령 꺼내기
+
+        is_ready의 결과가 바뀌면 wake()로 다시 확인하도록 알려야 함
+        """
+        while True:
+            try:
+                return self.get_nowait(is_ready)
+            except asyncio.QueueEmpty:
+                pass
+
+            self.waiter = asyncio.get_running_loop().create_future()
+            try:
+                await self.waiter
+            finally:
+                self.waiter = None
+
+    def wake(self):
+        """대기 중인 get()이 명령을 다시 확인하도록 알림"""
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+
+class BusArbiter:
+    """RS485 bus 전송 순서 관리 (bus가 사용 중이면 우선순위 순서대로 대기)"""
+
+    def __init__(self):
+        self.busy = False
+        self.waiters = []
+        self.counter = itertools.count()
+
+    async def acquire(self, priority):
+        """bus 사용 권한 획득"""
+        if not self.busy:
+            self.busy = True
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self.waiters, (priority, next(self.counter), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # 권한을 넘겨받은 후 취소되면 다음 대기자에게 넘김
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        """bus 사용 권한을 우선순위가 가장 높은 대기자에게 넘김 (대기자가 없으면 해제)"""
+        while self.waiters:
+            future = heapq.heappop(self.waiters)[2]
+            if not future.done():
+                future.set_result(None)
+                return
+
+        self.busy = False
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+RS485 노이즈 주입 기반 패킷 분리 내구성 측정
+사용법: python soak.py [--bitflip 확률] [--drop 확률] [--stray 확률] [--duration 초]
+
+합성 월패드 패킷에 bit 반전, byte 누락, 불필요한 F7 삽입을 섞고 EW11처럼 임의 크기로 잘라
+PacketProcessor.process_packet에 전달한 뒤 MB당 CPU 시간, 복구한 패킷 수,
+Checksum은 통과했지만 실제로는 보낸 적 없는 패킷(false frame) 수를 출력
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from benchmark import CHUNK_SIZE, load_config, synthetic_frames
+from device_manager import DeviceManager
+from mqtt_client import MQTTClientManager
+from packet_processor import PacketProcessor
+
+
+def corrupt_frame(frame, rng, bitflip, drop, stray):
+    """패킷에 노이즈를 섞어 (노이즈 섞인 byte, 손상 없이 남은 패킷 여부) 반환"""
+    noisy = bytearray()
+
+    # 패킷 앞에 F7 + 임의 byte 삽입
+    if rng.random() < stray * len(frame):
+        noisy += bytes([0xF7] + [rng.randrange(256) for _ in range(rng.randrange(1, 6))])
+
+    intact = True
+    for value in frame:
+        if rng.random() < drop:
+            intact = False
+            continue
+        if rng.random() < bitflip * 8:
+            value ^= 1 << rng.randrange(8)
+            intact = False
+        noisy.append(value)
+
+    return bytes(noisy), intact
+
+
+def split_chunks(data, rng, chunk_size=CHUNK_SIZE):
+    """EW11처럼 1 ~ chunk_size byte의 임의 크기로 분할"""
+    k = 0
+    while k < len(data):
+        size = rng.randint(1, chunk_size)
+        yield data[k:k + size]
+        k += size
+
+
+async def run(args):
+    """노이즈 섞인 데이터를 처리하며 복구/오인식 패킷 집계"""
+    rng = random.Random(args.seed)
+    config = load_config()
+    device_manager = DeviceManager()
+    mqtt_client = MQTTClientManager(config, device_manager)
+    mqtt_client.publish = lambda topic, payload, *a, **k: None
+    packet_processor = PacketProcessor(config, device_manager, mqtt_client)
+
+    # 중복 패킷 제거 없이 모든 패킷을 확인
+    device_manager.is_cached = lambda packet_key, packet_data: False
+
+    clean = set()
+    intact_frames = 0
+    stream = bytearray()
+    for timestamp, frame in synthetic_frames(args.duration, args.seed):
+        clean.add(frame)
+        noisy, intact = corrupt_frame(frame, rng, args.bitflip, args.drop, args.stray)
+        # 처리 함수가 등록된 STATE/ACK 패킷만 비교 대상
+        if intact and (frame[1], frame[3]) in packet_processor.decoders:
+            intact_frames += 1
+        stream += noisy
+
+    # dispatch 단계로 넘어가는 패킷을 가로채서 집계
+    recovered = [0]
+    false_frames = []
+    dispatch_frames = packet_processor.dispatch_frames
+
+    async def count_frames(frames):
+        for handler, packet, is_state_packet in frames:
+            if packet in clean:
+                recovered[0] += 1
+            else:
+                false_frames.append(packet)
+        await dispatch_frames(frames)
+
+    packet_processor.dispatch_frames = count_frames
+
+    cpu_started = time.process_time()
+    for chunk in split_chunks(bytes(stream), rng):
+        await packet_processor.process_packet(chunk)
+    cpu_time = time.process_time() - cpu_started
+
+    megabytes = len(stream) / (1024 * 1024)
+    print('stream        : {:.2f} MB, {} bytes discarded'.format(megabytes, packet_processor.discarded_bytes))
+    print('cpu           : {:.3f}s/MB'.format(cpu_time / megabytes if megabytes else 0))
+    print('recovered     : {} / {} intact frames ({:.2f}%)'.format(
+        recovered[0], intact_frames, 100 * recovered[0] / intact_frames if intact_frames else 0))
+    print('false frames  : {} ({:.2f}/MB)'.format(len(false_frames), len(false_frames) / megabytes if megabytes else 0))
+    for packet in false_frames[:args.show]:
+        print('  {}'.format(packet.hex().upper()))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='RS485 노이즈 주입 기반 패킷 분리 내구성 측정')
+    parser.add_argument('--bitflip', type=float, default=1e-3, help='bit 반전 확률 (bit당)')
+    parser.add_argument('--drop', type=float, default=1e-3, help='byte 누락 확률 (byte당)')
+    parser.add_argument('--stray', type=float, default=1e-3, help='F7 노이즈 삽입 확률 (byte당)')
+    parser.add_argument('--duration', type=float, default=3600, help='합성 데이터의 bus 시간 (초)')
+    parser.add_argument('--seed', type=int, default=0, help='합성 데이터 및 노이즈 seed')
+    parser.add_argument('--show', type=int, default=5, help='출력할 false frame 갯수')
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
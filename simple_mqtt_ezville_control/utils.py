@@ -1,4 +1,6 @@
+import operator
 import time
+from functools import reduce
 
 
 def log(string):
@@ -8,23 +10,37 @@ def log(string):
     return
 
 
+def _xor_add(data):
+    """bytes-like 데이터의 CHECKSUM(XOR) 및 ADD 계산"""
+    xor = reduce(operator.xor, data, 0)
+    add = (sum(data) + xor) & 0xFF
+    return xor, add
+
+
 def checksum(input_hex):
-    """CHECKSUM 및 ADD를 마지막 4 BYTE에 추가"""
+    """CHECKSUM 및 ADD를 마지막 4 BYTE에 추가 (송신 패킷 생성용)"""
     try:
         input_hex = input_hex[:-4]
         
         # 문자열 bytearray로 변환
         packet = bytes.fromhex(input_hex)
         
-        # checksum 생성
-        checksum = 0
-        for b in packet:
-            checksum ^= b
-        
-        # add 생성
-        add = (sum(packet) + checksum) & 0xFF 
+        # checksum 및 add 생성
+        checksum, add = _xor_add(packet)
         
         # checksum add 합쳐서 return
         return input_hex + format(checksum, '02X') + format(add, '02X')
     except:
         return None
+
+
+def verify_checksum(buffer, start=0, end=None):
+    """buffer[start:end] 패킷의 마지막 2 BYTE(XOR, ADD) 검증 (복사 없이 수신 버퍼에서 직접 확인)"""
+    if end is None:
+        end = len(buffer)
+    if end - start < 3:
+        return False
+    
+    with memoryview(buffer) as view:
+        xor, add = _xor_add(view[start:end - 2])
+        return view[end - 2] == xor and view[end - 1] == add